@@ -0,0 +1,143 @@
+"""
+Background writer of failure artifacts (screenshot, DOM snapshot, browser console log).
+after_scenario only grabs artifacts from the browser as bytes and queues them, files of logs/<scenario>
+and allure attachments are written by a worker thread while the next scenario runs.
+Artifacts are addressed by content hash: the same screenshot or DOM of many failed scenarios is written
+once per process (other copies in logs are hard links, allure attachments share one file).
+Text artifacts are gzipped in logs/<scenario>, allure gets them as is to show them in the report.
+after_all waits until everything is written.
+Attachments are reserved through internals of allure-python-commons (AllureReporter._attach and the reporter
+found among plugins by its "logger" attribute): the public allure.attach.file copies the file right away,
+which needs it written already. Both allure packages are pinned in requirements.txt for this reason,
+check _reserve_attachment when upgrading them.
+"""
+from allure_commons import plugin_manager
+from allure_commons.reporter import AllureReporter
+from concurrent.futures import ThreadPoolExecutor
+
+import threading
+import hashlib
+import logging
+import shutil
+import gzip
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# file extensions of artifacts compressed in logs/<scenario>
+COMPRESSED = ('.html', '.log')
+
+
+def _allure_reporter():
+    """
+    Reporter of allure-behave formatter, None if behave runs without "-f allure".
+    """
+    for plugin in plugin_manager.get_plugins():
+        reporter = getattr(plugin, 'logger', None)
+        if isinstance(reporter, AllureReporter):
+            return reporter
+    return None
+
+
+class ArtifactWriter(object):
+    """
+    Queue of artifacts written by one worker thread.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='artifacts')
+        self.futures = []
+        # content hash: path of the first copy in logs, written by the worker thread only
+        self.written = {}
+        # content hash: allure file name, reserved by hooks
+        self.attached = {}
+        self.lock = threading.Lock()
+
+    def add(self, report_dir, file_name, body, attachment_name=None, attachment_type=None):
+        """
+        Queue artifact for <report_dir>/<file_name> and allure attachment of the current scenario.
+        Attachment is added to the scenario right away, only its file is written later.
+        :param report_dir: str - folder of the scenario logs
+        :param file_name: str - e.g. __Fail.png, text artifacts get .gz suffix
+        :param body: bytes or str
+        :param attachment_name: str - name in allure report, None to skip allure
+        :param attachment_type: allure_commons.types.AttachmentType
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()
+
+        attachment = None
+        if attachment_name:
+            attachment = self._reserve_attachment(digest, attachment_name, attachment_type)
+        self.futures.append(self.executor.submit(self._write, report_dir, file_name, body, digest, attachment))
+
+    def _reserve_attachment(self, digest, name, attachment_type):
+        """
+        Attach the file of the digest to the running scenario.
+        Allure binds attachments to the running test when they are added, so it can't be done by the worker.
+        :return: (allure file name, function writing it), None if it is already written or there is no allure report
+        """
+        reporter = _allure_reporter()
+        if reporter is None:
+            return None
+        try:
+            # content addressed name, attachments of the same content point to one file
+            file_name = reporter._attach(digest, name=name, attachment_type=attachment_type)
+        except Exception as e:
+            logger.warning('Failed to attach %s to report: %r', name, e)
+            return None
+        with self.lock:
+            if digest in self.attached:
+                return None
+            self.attached[digest] = file_name
+        # plugins of allure are registered per thread, the worker has none
+        return file_name, plugin_manager.hook.report_attached_data
+
+    def _write(self, report_dir, file_name, body, digest, attachment):
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        path = os.path.join(report_dir, file_name)
+        if path.endswith(COMPRESSED):
+            path += '.gz'
+
+        if digest in self.written and self.written[digest] != path:
+            try:
+                os.link(self.written[digest], path)
+            except OSError:
+                shutil.copyfile(self.written[digest], path)
+        else:
+            if path.endswith('.gz'):
+                with gzip.open(path, 'wb') as artifact_file:
+                    artifact_file.write(body)
+            else:
+                with open(path, 'wb') as artifact_file:
+                    artifact_file.write(body)
+            self.written[digest] = path
+
+        if attachment:
+            allure_file, report_attached_data = attachment
+            report_attached_data(body=body, file_name=allure_file)
+        return path
+
+    def flush(self):
+        """
+        Wait until queued artifacts are written.
+        :return: int - artifacts failed to write
+        """
+        futures, self.futures = self.futures, []
+        failed = 0
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                logger.error('Failed to write artifact: %r', e)
+        return failed
+
+    def close(self):
+        failed = self.flush()
+        self.executor.shutdown()
+        if self.written:
+            logger.info('Failure artifacts: %s files written, %s failed', len(self.written), failed)
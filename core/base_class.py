@@ -5,7 +5,11 @@ from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import *
 
-from core.decorators import log_exception
+from core.decorators import log_exception, retry_on_stale, changes_page
+from core.browser_state import reset_browser_state
+from core import element_cache
+from core import profiler
+from core import scripts
 from utilities.config import Config
 
 import platform
@@ -19,6 +23,10 @@ class BaseClass(object):
     Contains all actions related to UI interaction.
     All pages may be inherited from this class.
     """
+    # seconds without DOM mutations for the page to be settled
+    SETTLE_QUIET = 0.3
+    # seconds of one settle script run, shorter than default script timeout of the drivers (30 seconds)
+    SETTLE_CHUNK = 20
 
     def __init__(self, browser):
         """
@@ -28,20 +36,33 @@ class BaseClass(object):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.timeout = 10
 
+    @property
+    def cached_elements(self):
+        """
+        Web elements found in the current page generation, shared by all pages of the browser.
+        :return: core.element_cache.ElementCache
+        """
+        return element_cache.for_browser(self.browser)
+
     @staticmethod
     def sleep(s):
+        if profiler.active() is not None:
+            profiler.active().sleep(s)
         time.sleep(s)
 
     @log_exception('Failed to clean cache and cookies')
     def clean_coockies_and_cache(self):
-        if Config.BROWSERNAME == 'Chrome':
-            self.browser.delete_all_cookies()
-            self.browser.get('chrome://settings/clearBrowserData')
-            self.sleep(2)
-            ActionChains(self.browser).send_keys(Keys.TAB * 3 + Keys.DOWN * 3).perform()
-            self.sleep(2)
-            ActionChains(self.browser).send_keys(Keys.TAB * 4 + Keys.ENTER).perform()
-            self.sleep(5)  # wait some time to finish
+        self.reset_browser_state()
+
+    @log_exception('Failed to reset browser state for origins: {}')
+    @changes_page
+    def reset_browser_state(self, origins=()):
+        """
+        Clear cookies, cache and storages of the browser (see core.browser_state).
+        :param origins: list of str - origins to clear storages of, current one is always cleared
+        """
+        way = reset_browser_state(self.browser, origins)
+        self.logger.info('Browser state is reset by %s', way)
 
     @log_exception('Failed to get web element with xpath: {}')
     def _get_element(self, element, ec=ec.presence_of_element_located, wait=None):
@@ -57,10 +78,17 @@ class BaseClass(object):
             wait = self.timeout
 
         if isinstance(element, str):
-            self.logger.debug('Waiting {} seconds for web element with condition: {}'.format(wait, ec.__name__))
-
-            wd_wait = WebDriverWait(self.browser, wait)
-            element = wd_wait.until(ec((By.XPATH, element)))
+            xpath = element
+            element = self.cached_elements.get(xpath, ec)
+            if element is not None:
+                self.logger.debug('Got web element from cache with condition: %s', ec.__name__)
+            else:
+                self.logger.debug('Waiting %s seconds for web element with condition: %s', wait, ec.__name__)
+
+                wd_wait = WebDriverWait(self.browser, wait)
+                with profiler.waiting():
+                    element = wd_wait.until(ec((By.XPATH, xpath)))
+                self.cached_elements.put(xpath, ec, element)
 
         if element:
             self.logger.debug('Got web element!')
@@ -78,24 +106,131 @@ class BaseClass(object):
         :param wait: int - wait time for object
         :return: tuple of selenium.webdriver.remote.webelement.WebElement
         """
-        self.logger.debug('Getting web elements with xpath: {}'.format(xpath))
-        self._get_element(xpath, wait=wait)
-        elements = self.browser.find_elements_by_xpath(xpath)
-        self.logger.debug('Got web elements with xpath: {}'.format(xpath))
+        if wait is None:
+            wait = self.timeout
+
+        self.logger.debug('Getting web elements with xpath: %s', xpath)
+        # one lookup waits for the elements and returns all of them
+        with profiler.waiting():
+            elements = WebDriverWait(self.browser, wait).until(ec.presence_of_all_elements_located((By.XPATH, xpath)))
+        self.logger.debug('Got web elements with xpath: %s', xpath)
         return elements
 
+    def _read_all(self, xpath, kind, name=None, wait=None):
+        """
+        Read one value of every element matching xpath in one script call (see scripts.READ_ALL).
+        :param wait: int - wait time for at least one element, 0 - read without waiting
+        :return: list of values, empty if there are no elements
+        """
+        if wait is None:
+            wait = self.timeout
+
+        self.logger.debug('Reading %s of web elements with xpath: %s', kind, xpath)
+        values = self.browser.execute_script(scripts.READ_ALL, xpath, kind, name)
+        if not values and wait:
+            try:
+                with profiler.waiting():
+                    values = WebDriverWait(self.browser, wait).until(
+                        lambda browser: browser.execute_script(scripts.READ_ALL, xpath, kind, name))
+            except TimeoutException:
+                values = []
+        self.logger.debug('Read %s values of web elements with xpath: %s', len(values), xpath)
+        return values
+
+    @log_exception('Failed to get texts of web elements with xpath: {}')
+    def get_texts(self, xpath, wait=None):
+        """
+        Texts of all elements matching xpath, in one round trip.
+        :param xpath: str - web elements xpath
+        :param wait: int - wait time for at least one element, 0 - don't wait
+        :return: list of str - rendered (innerText) texts, stripped
+        """
+        return self._read_all(xpath, 'text', wait=wait)
+
+    @log_exception('Failed to get attributes of web elements with xpath: {}')
+    def get_attributes(self, xpath, name, wait=None):
+        """
+        HTML attribute of all elements matching xpath, in one round trip.
+        Unlike WebElement.get_attribute, DOM properties are not read.
+        :param xpath: str - web elements xpath
+        :param name: str - attribute name
+        :param wait: int - wait time for at least one element, 0 - don't wait
+        :return: list of str or None for elements without the attribute
+        """
+        return self._read_all(xpath, 'attribute', name, wait=wait)
+
+    @log_exception('Failed to get visibility of web elements with xpath: {}')
+    def get_visibilities(self, xpath, wait=None):
+        """
+        Visibility of all elements matching xpath, in one round trip.
+        :param xpath: str - web elements xpath
+        :param wait: int - wait time for at least one element, 0 - don't wait
+        :return: list of boolean - element has a layout box and is not hidden by visibility style
+        """
+        return self._read_all(xpath, 'visible', wait=wait)
+
+    @log_exception('Failed to get rects of web elements with xpath: {}')
+    def get_rects(self, xpath, wait=None):
+        """
+        Position and size of all elements matching xpath, in one round trip.
+        :param xpath: str - web elements xpath
+        :param wait: int - wait time for at least one element, 0 - don't wait
+        :return: list of dict - x, y (relative to the document), width, height
+        """
+        return self._read_all(xpath, 'rect', wait=wait)
+
     def _highlight(self, element):
         """
         Highlight given web element with red border using JS execution.
-        WARNING: Contains time.sleep in 1 sec between scrolling to element and highlighting
+        Waits up to 1 sec for the page to settle after scrolling to element and after highlighting.
         :param element: selenium.webdriver.remote.webelement.WebElement
         """
         self.execute_script(element, 'scrollIntoView(true);')
-        self.sleep(1)
+        self.wait_until_settled(1)
         self.execute_script(element, 'setAttribute("style", "color: red; border: 5px solid red;");')
-        self.sleep(1)
+        self.wait_until_settled(1)
         self.execute_script(element, 'setAttribute("style", "");')
 
+    def wait_until_settled(self, timeout=None, quiet=None):
+        """
+        Wait until the page is settled: document is loaded, there are no pending fetch/XHR requests
+        and DOM is not changed for the quiet period. Does not raise on timeout, the caller decides what to do next.
+        Requests sent before the first call on the current document are not tracked.
+        :param timeout: float - maximum wait time, if None takes self.timeout
+        :param quiet: float - seconds without DOM mutations, if None takes SETTLE_QUIET
+        :return: boolean - True if the page is settled before timeout
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if quiet is None:
+            quiet = self.SETTLE_QUIET
+
+        deadline = time.time() + timeout
+        failures = 0
+        with profiler.waiting():
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    state = self.browser.execute_async_script(scripts.WAIT_FOR_SETTLED, int(quiet * 1000),
+                                                              int(min(remaining, self.SETTLE_CHUNK) * 1000))
+                except UnexpectedAlertPresentException:
+                    break
+                except WebDriverException as e:
+                    # document is unloaded while the script runs, try again on the new one
+                    failures += 1
+                    if failures > 3:
+                        self.logger.debug('Cannot check if the page is settled: %s', e.msg)
+                        break
+                    continue
+                if state['settled']:
+                    self.logger.debug('Page is settled in %s ms', state['waited'])
+                    return True
+
+        self.logger.debug('Page is not settled in %s seconds', timeout)
+        return False
+
     @log_exception('Failed presence check of web element with xpath: {}')
     def is_present(self, xpath, expected=True, wait=None):
         """
@@ -110,12 +245,13 @@ class BaseClass(object):
         if not expected:
             expected_condition = ec.staleness_of
 
-        self.logger.info('Checking presence of web element with xpath: {}. Expected: {!s}'.format(xpath, expected))
+        self.logger.debug('Checking presence of web element with xpath: %s. Expected: %s', xpath, expected)
         found = self._get_element(xpath, expected_condition, wait=wait) is not None
-        self.logger.info('Presence check of web element with xpath: {}. Result: {!s}'.format(xpath, found))
+        self.logger.info('Presence check of web element with xpath: %s. Result: %s', xpath, found)
         return found
 
     @log_exception('Failed visible check of web element with xpath: {}')
+    @retry_on_stale
     def is_visible(self, xpath, expected=True, wait=None):
         """
         Visibility check of web element on the UI.
@@ -129,24 +265,26 @@ class BaseClass(object):
         if not expected:
             expected_condition = ec.invisibility_of_element_located
 
-        self.logger.info('Checking visibility of web element with xpath: {}. Expected: {!s}'.format(xpath, expected))
+        self.logger.debug('Checking visibility of web element with xpath: %s. Expected: %s', xpath, expected)
         found = self._get_element(xpath, expected_condition, wait=wait).is_displayed()
-        self.logger.info('Visible check of web element with xpath: {}. Result: {!s}'.format(xpath, found))
+        self.logger.info('Visible check of web element with xpath: %s. Result: %s', xpath, found)
         return found
 
     @log_exception('Failed to click web element with xpath: {}')
+    @retry_on_stale
+    @changes_page
     def click(self, xpath, wait=None, scroll=True):
         """
         Click web element with given xpath
         :param xpath: str - web element xpath
         :param wait: int - wait time for object
         """
-        self.logger.info('Clicking web element with xpath: {}'.format(xpath))
+        self.logger.debug('Clicking web element with xpath: %s', xpath)
         element = self._get_element(xpath, ec.element_to_be_clickable, wait=wait)
         if scroll:
             self.execute_script(element, 'scrollIntoView(true);')
         element.click()
-        self.logger.info('Clicked web element with xpath: {}'.format(xpath))
+        self.logger.info('Clicked web element with xpath: %s', xpath)
 
     def execute_script(self, element, script):
         """
@@ -161,6 +299,8 @@ class BaseClass(object):
         return self.browser.execute_script("return arguments[0].{}".format(script), element)
 
     @log_exception('Failed to mouse over web element with xpath: {}')
+    @retry_on_stale
+    @changes_page
     def mouse_over(self, xpath, wait=None):
         """
         Simulate mouse cursor over given web element.
@@ -169,9 +309,11 @@ class BaseClass(object):
         """
         actions = ActionChains(self.browser)
         actions.move_to_element(self._get_element(xpath, wait=wait)).perform()
-        self.logger.info('Mouse over web element with xpath: {}'.format(xpath))
+        self.logger.info('Mouse over web element with xpath: %s', xpath)
 
     @log_exception('Failed to mouse over web element with xpath: {}')
+    @retry_on_stale
+    @changes_page
     def mouse_over_with_offset(self, xpath, xoffset, yoffset, wait=None):
         """
         Simulate mouse cursor over given web element.
@@ -180,9 +322,10 @@ class BaseClass(object):
         """
         actions = ActionChains(self.browser)
         actions.move_to_element_with_offset(self._get_element(xpath, wait=wait), xoffset, yoffset).perform()
-        self.logger.info('Mouse over web element with xpath: {}'.format(xpath))
+        self.logger.info('Mouse over web element with xpath: %s', xpath)
 
     @log_exception('Failed to move mouse to coordinates: {}, {}')
+    @changes_page
     def mouse_move_to_coordinates(self, x, y):
         """
         Simulate mouse cursor move.
@@ -193,6 +336,7 @@ class BaseClass(object):
         actions.move_by_offset(x, y).perform()
 
     @log_exception('Failed to drag mouse')
+    @changes_page
     def mouse_drag(self, x1, y1, x2, y2):
         """
         Simulate drag mouse from x1 y1 to x2 y2.
@@ -204,18 +348,20 @@ class BaseClass(object):
             .move_by_offset(x2 - x1, y2 - y1)\
             .release()\
             .perform()
-        self.logger.info('Mouse drag for: {}, {}'.format(x2 - x1, y2 - y1))
+        self.logger.info('Mouse drag for: %s, %s', x2 - x1, y2 - y1)
 
     @log_exception('Failed open URL: {}')
+    @changes_page
     def open(self, url):
         """
         Open given URL in browser
         :param url: str - URL to open
         """
         self.browser.get(url)
-        self.logger.info('Opened URL: {}'.format(url))
+        self.logger.info('Opened URL: %s', url)
 
     @log_exception('Failed open new tab: {}')
+    @changes_page
     def open_new_tab(self):
         """
         Open new tab in browser
@@ -223,11 +369,13 @@ class BaseClass(object):
         win_handles_befor = self.browser.window_handles
         self.browser.execute_script("window.open('');")
         win_handles_after = self.browser.window_handles
-        WebDriverWait(self.browser, self.timeout).until(ec.number_of_windows_to_be(len(win_handles_befor) + 1))
+        with profiler.waiting():
+            WebDriverWait(self.browser, self.timeout).until(ec.number_of_windows_to_be(len(win_handles_befor) + 1))
         new_window = [x for x in win_handles_after if x not in win_handles_befor][0]
         self.browser.switch_to_window(new_window)
 
     @log_exception('Failed to switch tab: {}')
+    @changes_page
     def switch_to_tab_with_num(self, tab_num):
         """
         Switches driver to new tab only. Works by number of tab, counts from 0.
@@ -235,6 +383,8 @@ class BaseClass(object):
         self.browser.switch_to_window(self.browser.window_handles[tab_num])
 
     @log_exception('Cannot switch to frame: {}')
+    @retry_on_stale
+    @changes_page
     def switch_to_frame(self, xpath, wait=None):
         """
         Switch to frame
@@ -243,6 +393,7 @@ class BaseClass(object):
         self.browser.switch_to.frame(self._get_element(xpath, wait=wait))
 
     @log_exception('Cannot switch to default frame')
+    @changes_page
     def switch_to_default_frame(self):
         """
         Switch to default frame
@@ -250,51 +401,56 @@ class BaseClass(object):
         self.browser.switch_to.default_content()
 
     @log_exception('Cannot get text located: {}')
+    @retry_on_stale
     def get_text(self, xpath, wait=None):
         """
         Get text of the web element
         :param xpath: str - web element xpath
         :param wait: int - wait time for object
         """
-        self.logger.info('Trying to get text from field with xpath: {}'.format(xpath))
+        self.logger.debug('Trying to get text from field with xpath: %s', xpath)
         result = self._get_element(xpath, ec.visibility_of_element_located, wait=wait).text
-        self.logger.info('Got text "{}" from field with xpath: {}'.format(result, xpath))
+        self.logger.info('Got text "%s" from field with xpath: %s', result, xpath)
         return result
 
     @log_exception('Failed to type text into web element with xpath: {}')
+    @retry_on_stale
+    @changes_page
     def type(self, xpath, text, one_by_one=False, wait=None, lazy_wait=2):
         """
         Type text into input field with given xpath
         :param xpath: str - web element xpath
         :param text: str - text to type
         :param wait: int - wait time for object
-        :param lazy_wait: int - wait time for lazy download objects
+        :param lazy_wait: int - maximum wait time for the page to settle (lazy download objects)
         """
-        self.logger.info('Typing "{}" into field with xpath: {}'.format(text, xpath))
+        self.logger.debug('Typing "%s" into field with xpath: %s', text, xpath)
         input_field = self._get_element(xpath, ec.visibility_of_element_located, wait=wait)
         if platform.system() == 'Darwin':   # mac os
             input_field.clear()
         else:                               # others
             input_field.send_keys(Keys.CONTROL, 'a', Keys.DELETE)
-        self.sleep(lazy_wait / 2)
+        self.wait_until_settled(lazy_wait / 2)
         if one_by_one:
             for char in text:
                 input_field.send_keys(char)
         else:
             input_field.send_keys(text)
-        self.sleep(lazy_wait / 2)
-        self.logger.info('Typed "{}" into field with xpath: {}'.format(text, xpath))
+        self.wait_until_settled(lazy_wait / 2)
+        self.logger.info('Typed "%s" into field with xpath: %s', text, xpath)
 
     @log_exception('Cannot send ENTER to the web element with xpath: {}')
+    @retry_on_stale
+    @changes_page
     def send_enter(self, xpath, wait=None, lazy_wait=1):
         """
         Emulate sending ENTER key from keyboard to the given web element.
         :param xpath: str - web element xpath
         :param wait: int - wait time for object
-        :param lazy_wait: int - wait time for lazy download objects
+        :param lazy_wait: int - maximum wait time for the page to settle (lazy download objects)
         """
         self._get_element(xpath, wait=wait).send_keys(Keys.ENTER)
-        self.sleep(lazy_wait)
+        self.wait_until_settled(lazy_wait)
 
     def submit_search(self, xpath, text, wait=None, lazy_wait=2):
         """
@@ -302,11 +458,12 @@ class BaseClass(object):
         :param xpath: str - web element xpath
         :param text: str - text to type
         :param wait: int - wait time for object
-        :param lazy_wait: int - wait time for lazy download objects
+        :param lazy_wait: int - maximum wait time for the page to settle (lazy download objects)
         """
         self.type(xpath, text, wait=wait, lazy_wait=lazy_wait)
         self.send_enter(xpath, wait=wait, lazy_wait=lazy_wait)
 
+    @retry_on_stale
     def get_element_size(self, element_locator, wait=None):
         """
         Return size of element in list
@@ -17,18 +17,29 @@ for feature in all_features:
 after_all
 """
 from allure_commons.types import AttachmentType
-import allure
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 
 from utilities.config import Config
 from utilities.log import Logger
+from utilities.shared_store import SharedStore
+from utilities.timing_db import TimingRecorder
+from utilities.behave_worker import THREAD_KEY, WARM_KEY
+from core import profiler
+from core.browser_state import reset_browser_state
+from core import browser_pool
+from core import browser_pipeline
+from core import driver_factory
+from core import network_policy
+from core import network_log
+from core import page_timings
+from core.artifacts import ArtifactWriter
+
+from functools import partial
 
-from psutil import Process
-
-import platform
 import logging
 import json
-import os
-import re
+import time
 
 
 def before_all(context):
@@ -41,7 +52,11 @@ def before_all(context):
     Context injected automatically by Behave.
     :type context: behave.runner.Context
     """
-    Logger.configure_logging()
+    # behave runs of "--mode thread" share logging of the process, see utilities.behave_worker
+    context.thread = context.config.userdata.get(THREAD_KEY)
+    # console shows only start and end of scenarios and warnings, use -D console_summary=false to see everything
+    Logger.configure_logging(summary=context.config.userdata.getbool('console_summary', True),
+                             keep_running=context.thread is not None)
     logger = logging.getLogger(__name__)
 
     if context.config.userdata:
@@ -49,11 +64,21 @@ def before_all(context):
 
         Config.REUSE = context.config.userdata.get('reuse', Config.REUSE)
         Config.HIGHLIGHT = context.config.userdata.get('highlight', Config.HIGHLIGHT)
+        Config.PROFILE = context.config.userdata.getbool('profile', Config.PROFILE)
+        Config.RESET_ON_REUSE = context.config.userdata.getbool('reset_on_reuse', Config.RESET_ON_REUSE)
+        Config.BROWSER_POOL = context.config.userdata.getbool('browser_pool', Config.BROWSER_POOL)
+        Config.POOL_MAX_USES = int(context.config.userdata.get('pool_max_uses', Config.POOL_MAX_USES))
+        Config.BROWSER_PIPELINE = context.config.userdata.getbool('browser_pipeline', Config.BROWSER_PIPELINE)
+        Config.PIPELINE_SESSIONS = int(context.config.userdata.get('pipeline_sessions', Config.PIPELINE_SESSIONS))
+        Config.PAGE_TIMINGS = context.config.userdata.getbool('page_timings', Config.PAGE_TIMINGS)
+        Config.FAILURE_DOM = context.config.userdata.getbool('failure_dom', Config.FAILURE_DOM)
+        Config.FAILURE_CONSOLE = context.config.userdata.getbool('failure_console', Config.FAILURE_CONSOLE)
 
         Config.BROWSERTYPE = context.config.userdata.get('browsertype', Config.BROWSERTYPE)
         Config.PLATFORM = context.config.userdata.get('osplatform', Config.PLATFORM)
         Config.BROWSERNAME = context.config.userdata.get('browsername', Config.BROWSERNAME)
         Config.VERSION = context.config.userdata.get('browserver', Config.VERSION)
+        Config.LAUNCH_PROFILE = context.config.userdata.get('launch_profile', Config.LAUNCH_PROFILE)
 
         context.lt_username = context.config.userdata.get('lt_username', "ERROR_LT_USERNAME")
         context.lt_access_key = context.config.userdata.get('lt_access_key', "ERROR_LT_ACCESS_KEY")
@@ -62,28 +87,34 @@ def before_all(context):
 
     context.run_mode = context.config.userdata.get('behave_run_mode', "ERROR_RUN_MODE")
 
-    # pid from parallel_runner
-    if platform.system() == 'Windows':
-        # On Win: pool_process -> cmd (call function) -> behave -> python -> before_all (hook)
-        parent_runner_pid = Process(Process(Process(Process(os.getpid()).ppid()).ppid()).ppid()).ppid()
-    elif platform.system() == 'Linux':
-        # On Lin: pool_process -> behave -> before_all (hook)
-        parent_runner_pid = Process(Process(os.getpid()).ppid()).ppid()
-    elif platform.system() == 'Darwin':
-        # On Darwin: pool_process -> behave -> before_all (hook)
-        parent_runner_pid = Process(Process(os.getpid()).ppid()).ppid()
-
-    logger.info("parent pid: " + str(parent_runner_pid))
-
-    if context.run_mode == 'Multithreaded' and os.path.exists("pid_" + str(parent_runner_pid) + ".db"):
-        with open("pid_" + str(parent_runner_pid) + ".db", "r") as context_file:
-            content = context_file.read()
-            variables = re.findall(r"<var_beg>(.+?)<var_end>", content)
-            for var in variables:
-                if "project_db" in var:
-                    context.project_db = json.loads(var.replace("project_db=", '').replace("'", '"'))
+    project_db = json.loads(Config.PROJECT_DB.replace("'", '"'))
+    # store of parallel_runner is shared by all its behave processes, every key is updated atomically
+    store = SharedStore.from_env() if context.run_mode == 'Multithreaded' else None
+    if store is not None:
+        logger.info('shared project_db: %s', store.path)
+        for key, value in project_db.items():
+            store.setdefault(key, value)
+        context.project_db = store
     else:
-        context.project_db = json.loads(Config.PROJECT_DB.replace("'", '"'))
+        context.project_db = project_db
+
+    # timings of features, scenarios and steps, only when started by parallel_runner
+    context.timings = TimingRecorder.from_env(worker=context.thread)
+
+    # WebDriver commands, sleeps and waits of every step, see core.profiler
+    context.profiler = profiler.enable() if Config.PROFILE else None
+
+    # requests blocked by scenario tags, see core.network_policy
+    context.network_policies = network_policy.load_policies()
+    context.resource_sizes = network_policy.ResourceSizes(network_policy.SIZES_FILE)
+
+    # screenshots and other failure artifacts are written in background, see core.artifacts
+    context.artifacts = ArtifactWriter()
+
+    # browser pipeline starts the next browser only if another scenario follows in this worker
+    context.warm_worker = context.config.userdata.getbool(WARM_KEY, False)
+    context.run_scenarios = [scenario for feature in context._runner.features for scenario in feature.walk_scenarios()
+                             if scenario.should_run(context.config)]
 
 
 def after_all(context):
@@ -93,25 +124,21 @@ def after_all(context):
     Context injected automatically by Behave.
     :type context: behave.runner.Context
     """
-    if context.run_mode == 'Multithreaded':
-        # pid from parallel_runner
-        if platform.system() == 'Windows':
-            # On Win: pool_process -> cmd (call function) -> behave -> python -> before_all (hook)
-            parent_runner_pid = Process(Process(Process(Process(os.getpid()).ppid()).ppid()).ppid()).ppid()
-        elif platform.system() == 'Linux':
-            # On Lin: pool_process -> behave -> before_all (hook)
-            parent_runner_pid = Process(Process(os.getpid()).ppid()).ppid()
-        elif platform.system() == 'Darwin':
-            # On Darwin: pool_process -> behave -> before_all (hook)
-            parent_runner_pid = Process(Process(os.getpid()).ppid()).ppid()
-
     if context.project_db:
         logger = logging.getLogger(__name__)
-        logger.info("context.project_db in this thread: " + str(context.project_db).replace("'", '"'))
+        logger.info('context.project_db in this thread: %s', json.dumps(dict(context.project_db)))
+
+    # shared store is already up to date, every change was written when it was made
+    if isinstance(context.project_db, SharedStore):
+        context.project_db.close()
 
-        if context.run_mode == 'Multithreaded':
-            with open("pid_" + str(parent_runner_pid) + ".db", "w") as context_file:
-                context_file.write("<var_beg>" + "project_db=" + str(context.project_db) + "<var_end>\n")
+    if context.timings:
+        context.timings.close()
+
+    context.resource_sizes.save()
+
+    # nothing queued is lost, allure report already refers to the files
+    context.artifacts.close()
 
 
 def before_feature(context, feature):
@@ -125,6 +152,11 @@ def before_feature(context, feature):
     logger = logging.getLogger(__name__)
 
     context.browser = None
+    context.browser_startup = None
+    context.browser_profile = None
+    context.network_tags = []
+    context.network_log = None
+    context.page_timings = None
 
 
 def after_feature(context, feature):
@@ -137,6 +169,10 @@ def after_feature(context, feature):
     """
     logger = logging.getLogger(__name__)
 
+    if context.timings:
+        context.timings.feature(feature)
+        context.timings.flush()
+
 
 def before_scenario(context, scenario):
     """
@@ -147,48 +183,124 @@ def before_scenario(context, scenario):
     :type context: behave.runner.Context
     :type scenario: behave.model.Scenario
     """
-    Logger.create_test_folder(scenario.name)
+    Logger.start_scenario(scenario.name)
     logger = logging.getLogger(__name__)
 
-    if context.browser is None:
-        try:
-            if Config.BROWSERTYPE == 'Local':
-                if Config.BROWSERNAME == 'Chrome':
-                    context.browser = Config.browser_types[Config.BROWSERNAME](chrome_options=Config.CHROME_OPTIONS)
-                    context.browser.set_window_size(1920, 1080)
-                if Config.BROWSERNAME == 'Firefox':
-                    context.browser = Config.browser_types[Config.BROWSERNAME]()
-                    context.browser.set_window_size(1920, 1080)
-                if Config.BROWSERNAME == 'Edge':
-                    context.browser = Config.browser_types[Config.BROWSERNAME]()
-                    context.browser.set_window_size(1920, 1080)
-            elif Config.BROWSERTYPE == 'Remote':
-                url = "https://" + context.lt_username + ":" + context.lt_access_key + "@hub.lambdatest.com/wd/hub"
-                desired_cap = {
-                    "platform": Config.PLATFORM,
-                    "browserName": Config.BROWSERNAME,
-                    "version": Config.VERSION,
-                    "resolution": "1920x1080",
-                    "name": scenario.name,
-                    "build": context.build,
-                    "tunnel": True,
-                    "tunnelName": context.lt_tunnel,
-                    "console": True,
-                    "network": False,
-                    "visual": True
-                }
-                context.browser = Config.browser_types[Config.BROWSERTYPE](
-                    desired_capabilities=desired_cap,
-                    command_executor=url
-                )
-            else:
-                print('Wrong type of browser')
-        except Exception:
-            logger.error(
-                'Failed to start browser: {}'.format(Config.BROWSERNAME))
-            raise
+    context.browser_startup = None
+    context.network_tags = network_policy.scenario_policies(scenario, context.network_policies)
+    # browsers of pool and pipeline are started by profile, another profile needs another browser
+    context.browser_profile = driver_factory.scenario_profile(scenario)
+    if Config.BROWSER_POOL:
+        # browser of the worker pool, already reset after the previous scenario
+        startup_begin = time.time()
+        context.browser = browser_pool.worker_pool(Config.POOL_MAX_USES).lease(
+            partial(_start_browser, context, scenario), context.browser_profile)
+        context.browser_startup = time.time() - startup_begin
+    elif Config.BROWSER_PIPELINE:
+        # browser is started in background during the previous scenario
+        startup_begin = time.time()
+        context.browser = browser_pipeline.worker_pipeline(Config.PIPELINE_SESSIONS).acquire(
+            partial(_start_browser, context, scenario), context.browser_profile,
+            prefetch=context.warm_worker or _scenarios_follow(context, scenario))
+        context.browser_startup = time.time() - startup_begin
+        if Config.BROWSERTYPE == 'Remote':
+            # session is started before its scenario is known
+            context.browser.execute_script('lambda-name={}'.format(scenario.name))
+    elif context.browser is None:
+        startup_begin = time.time()
+        context.browser = _start_browser(context, scenario)
+        context.browser_startup = time.time() - startup_begin
+    elif Config.RESET_ON_REUSE:
+        # reused browser keeps cookies and storages of the previous scenario
+        logger.info('Browser state is reset by %s', reset_browser_state(context.browser))
+
+    # empty list unblocks requests blocked for the previous scenario of the same browser
+    patterns = [pattern for tag in context.network_tags for pattern in context.network_policies[tag]]
+    context.network_log = None
+    if network_policy.needs_apply(context.browser, patterns):
+        if network_policy.apply(context.browser, patterns):
+            # requests of the scenario measure sizes of resources, blocked ones are counted as saved
+            context.network_log = network_log.for_browser(context.browser)
+            context.network_log.clear()
+            if patterns:
+                logger.info('Blocked URLs of %s: %s', ', '.join(context.network_tags), len(patterns))
+    elif Config.PAGE_TIMINGS:
+        # page timings read the network events anyway, sizes of loaded resources are learned for free
+        context.network_log = network_log.for_browser(context.browser)
+
+    # pages visited by the scenario, see core.page_timings
+    context.page_timings = page_timings.PageTimings(context.browser) if Config.PAGE_TIMINGS else None
+
+    if context.profiler:
+        context.profiler.start_scenario(scenario.name)
+        context.profiler.attach(context.browser)
+
+    logger.info('Start of test: %s', scenario.name, extra={'summary': True})
+
+
+def _scenarios_follow(context, scenario):
+    """
+    True if the behave run has scenarios to run after this one.
+    """
+    for index, run_scenario in enumerate(context.run_scenarios):
+        if run_scenario is scenario:
+            return index < len(context.run_scenarios) - 1
+    return False
 
-    logger.info('Start of test: {}'.format(scenario.name))
+
+def _start_browser(context, scenario):
+    """
+    Start a new browser of Config.BROWSERTYPE and Config.BROWSERNAME with Full HD resolution.
+    :type context: behave.runner.Context
+    :type scenario: behave.model.Scenario
+    :return: selenium.webdriver.*
+    """
+    logger = logging.getLogger(__name__)
+
+    browser = None
+    try:
+        if Config.BROWSERTYPE == 'Local':
+            if Config.BROWSERNAME == 'Chrome':
+                # session of the worker chromedriver with the launch profile of the scenario
+                browser = driver_factory.worker_factory().chrome(driver_factory.scenario_profile(scenario))
+                browser.set_window_size(1920, 1080)
+            if Config.BROWSERNAME == 'Firefox':
+                # Firefox can't block URLs, prefs of the policies are set once at start
+                options = webdriver.FirefoxOptions()
+                for name, value in network_policy.firefox_prefs(
+                        network_policy.scenario_policies(scenario, context.network_policies)).items():
+                    options.set_preference(name, value)
+                browser = Config.browser_types[Config.BROWSERNAME](options=options)
+                browser.set_window_size(1920, 1080)
+            if Config.BROWSERNAME == 'Edge':
+                browser = Config.browser_types[Config.BROWSERNAME]()
+                browser.set_window_size(1920, 1080)
+        elif Config.BROWSERTYPE == 'Remote':
+            url = "https://" + context.lt_username + ":" + context.lt_access_key + "@hub.lambdatest.com/wd/hub"
+            desired_cap = {
+                "platform": Config.PLATFORM,
+                "browserName": Config.BROWSERNAME,
+                "version": Config.VERSION,
+                "resolution": "1920x1080",
+                "name": scenario.name,
+                "build": context.build,
+                "tunnel": True,
+                "tunnelName": context.lt_tunnel,
+                "console": True,
+                "network": False,
+                "visual": True
+            }
+            browser = Config.browser_types[Config.BROWSERTYPE](
+                desired_capabilities=desired_cap,
+                command_executor=url
+            )
+        else:
+            print('Wrong type of browser')
+    except Exception:
+        logger.error(
+            'Failed to start browser: {}'.format(Config.BROWSERNAME))
+        raise
+    return browser
 
 
 def after_scenario(context, scenario):
@@ -203,23 +315,20 @@ def after_scenario(context, scenario):
     """
     logger = logging.getLogger(__name__)
 
+    if context.timings:
+        context.timings.scenario(scenario, context.browser_startup, context.browser_profile)
+
+    if context.network_log:
+        _network_savings(context, scenario)
+
     if scenario.status == 'failed':
-        _screenshot = '{}/{}/__Fail.png'.format(Config.LOG_DIR, scenario.name.replace(' ', '_'))
+        _failure_artifacts(context, scenario)
 
-        try:
-            context.browser.save_screenshot(_screenshot)
-        except Exception:
-            logger.error(
-                'Failed to take screenshot to: {}'.format(Config.LOG_DIR))
-            raise
+    if context.profiler:
+        context.profiler.report('{}/{}'.format(Config.LOG_DIR, scenario.name.replace(' ', '_')))
 
-        try:
-            with open(_screenshot, 'rb') as _file:
-                allure.attach(_file.read(), '{} fail'.format(scenario.name), AttachmentType.PNG)
-        except Exception:
-            logger.error(
-                'Failed to attach to report screenshot: {}'.format(_screenshot))
-            raise
+    if context.page_timings:
+        context.page_timings.report('{}/{}'.format(Config.LOG_DIR, scenario.name.replace(' ', '_')))
 
     if Config.BROWSERTYPE == 'Remote':
         if scenario.status == 'failed':
@@ -228,7 +337,14 @@ def after_scenario(context, scenario):
         if scenario.status == 'passed':
             context.browser.execute_script('lambda-status=passed')
 
-    if not Config.REUSE:
+    if Config.BROWSER_POOL:
+        # browser state after a failed scenario is unknown, pool recycles it
+        browser_pool.worker_pool(Config.POOL_MAX_USES).release(context.browser, failed=scenario.status == 'failed')
+        context.browser = None
+    elif Config.BROWSER_PIPELINE:
+        browser_pipeline.worker_pipeline(Config.PIPELINE_SESSIONS).release(context.browser)
+        context.browser = None
+    elif not Config.REUSE:
         try:
             context.browser.quit()
         except Exception:
@@ -238,7 +354,69 @@ def after_scenario(context, scenario):
 
         context.browser = None
 
-    logger.info('End of test: {}. Status: {} !!!\n\n\n'.format(scenario.name, scenario.status))
+    logger.info('End of test: %s. Status: %s !!!\n\n\n', scenario.name, scenario.status, extra={'summary': True})
+    Logger.end_scenario()
+
+
+def _failure_artifacts(context, scenario):
+    """
+    Grab screenshot (DOM and console log if enabled) of the failed scenario and queue them for writing.
+    :type context: behave.runner.Context
+    :type scenario: behave.model.Scenario
+    """
+    logger = logging.getLogger(__name__)
+    report_dir = '{}/{}'.format(Config.LOG_DIR, scenario.name.replace(' ', '_'))
+
+    try:
+        screenshot = context.browser.get_screenshot_as_png()
+    except Exception:
+        logger.error(
+            'Failed to take screenshot of: {}'.format(scenario.name))
+        raise
+    context.artifacts.add(report_dir, '__Fail.png', screenshot, '{} fail'.format(scenario.name), AttachmentType.PNG)
+
+    if Config.FAILURE_DOM:
+        try:
+            context.artifacts.add(report_dir, '__Fail.html', context.browser.page_source,
+                                  '{} DOM'.format(scenario.name), AttachmentType.HTML)
+        except WebDriverException as e:
+            logger.error('Failed to get DOM of: %s. %s', scenario.name, e.msg)
+
+    if Config.FAILURE_CONSOLE:
+        try:
+            # only Chrome keeps console messages for WebDriver
+            entries = context.browser.get_log('browser')
+        except WebDriverException as e:
+            logger.warning('Browser console log is not available: %s', e.msg)
+        else:
+            console = '\n'.join('{} {} {}'.format(entry['timestamp'], entry['level'], entry['message'])
+                                 for entry in entries)
+            context.artifacts.add(report_dir, '__Fail_console.log', console,
+                                  '{} console'.format(scenario.name), AttachmentType.TEXT)
+
+
+def _network_savings(context, scenario):
+    """
+    Log and record requests blocked by network policies of the scenario, learn sizes of loaded ones.
+    :type context: behave.runner.Context
+    :type scenario: behave.model.Scenario
+    """
+    logger = logging.getLogger(__name__)
+
+    try:
+        requests = context.network_log.requests()
+    except Exception as e:
+        logger.warning('Failed to read network requests: %r', e)
+        return
+    context.resource_sizes.update(requests)
+    if not context.network_tags:
+        return
+
+    blocked, saved_bytes, unknown_size = context.resource_sizes.savings(requests)
+    logger.info('Network policies %s blocked %s requests, saved %.1f KB (%s of unknown size)',
+                ', '.join(context.network_tags), blocked, saved_bytes / 1024, unknown_size)
+    if context.timings:
+        context.timings.network(scenario, context.network_tags, blocked, saved_bytes, unknown_size)
 
 
 def before_step(context, step):
@@ -251,6 +429,9 @@ def before_step(context, step):
     """
     logger = logging.getLogger(__name__)
 
+    if context.profiler:
+        context.profiler.start_step('{} {}'.format(step.keyword, step.name))
+
 
 def after_step(context, step):
     """
@@ -261,6 +442,15 @@ def after_step(context, step):
     """
     logger = logging.getLogger(__name__)
 
+    if context.timings:
+        context.timings.step(context.scenario, step)
+
+    if context.profiler:
+        context.profiler.end_step()
+
+    if context.page_timings:
+        context.page_timings.capture()
+
     if step.status.name == 'failed':  # get last traceback and error message
         context.last_traceback = step.error_message
         if step.error_message is not None:
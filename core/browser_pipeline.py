@@ -0,0 +1,128 @@
+"""
+Pipelined browser lifecycle of one worker process.
+While a scenario runs, the browser for the next one is already starting in a background thread
+(only when the worker has more scenarios to run, see acquire),
+and the browser of the finished scenario quits in background too, so the worker never waits
+for browser startup or teardown (except the very first start).
+Sessions alive at once (running, starting and quitting ones) are limited by a semaphore,
+so a worker never holds more than max_sessions sessions of the grid.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import util
+
+from utilities.config import Config
+
+import threading
+import logging
+import atexit
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# pipeline of the current worker (process, or thread with "--mode thread"), see worker_pipeline
+_local = threading.local()
+
+
+def worker_pipeline(max_sessions=2):
+    """
+    Pipeline of the current worker, created on first call.
+    :param max_sessions: int - browser sessions of the worker alive at once, at least 2 to start the next one in advance
+    :return: BrowserPipeline
+    """
+    pipeline = getattr(_local, 'pipeline', None)
+    if pipeline is None:
+        pipeline = _local.pipeline = BrowserPipeline(max_sessions)
+        # pool workers of multiprocessing exit without atexit handlers, but run finalizers
+        util.Finalize(pipeline, pipeline.close, exitpriority=10)
+        atexit.register(pipeline.close)
+    return pipeline
+
+
+class BrowserPipeline(object):
+    """
+    Starts browsers ahead of time and quits them in background.
+    """
+    # seconds to wait for the browser started in advance when the worker exits
+    CLOSE_TIMEOUT = 120
+
+    def __init__(self, max_sessions=2):
+        self.sessions = threading.BoundedSemaphore(max(max_sessions, 1))
+        # a start waiting for a free session must not block the quit which frees it
+        self.executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='browser-pipeline')
+        self.next = None
+        self.next_key = None
+        self.closed = False
+
+    def _start(self, factory):
+        self.sessions.acquire()
+        try:
+            start = time.time()
+            browser = factory()
+            logger.info('Browser started in background in %.2fs', time.time() - start)
+            return browser
+        except Exception:
+            self.sessions.release()
+            raise
+
+    def _quit(self, browser):
+        try:
+            start = time.time()
+            browser.quit()
+            logger.debug('Browser quit in background in %.2fs', time.time() - start)
+        except Exception as e:
+            logger.warning('Failed to quit browser: %r', e)
+        finally:
+            self.sessions.release()
+
+    def _quit_started(self, future):
+        try:
+            browser = future.result()
+        except Exception:
+            return
+        self._quit(browser)
+
+    def acquire(self, factory, key=None, prefetch=True):
+        """
+        Browser started in advance (or a new one if there is none) and start of the next one in background.
+        The next one is started with the same key, expecting the next scenario to be alike.
+        :param factory: function - starts a new browser, called from a background thread
+        :param key: str - kind of the browser (launch profile), browser started with another key is not used
+        :param prefetch: boolean - start the next browser, False when no other scenario follows in the worker
+        :return: selenium.webdriver.*
+        """
+        # background thread sees Config of the calling behave run
+        factory = Config.bound(factory)
+        future, self.next = self.next, None
+        if future is not None and self.next_key != key:
+            self.executor.submit(self._quit_started, future)
+            future = None
+        if future is None:
+            future = self.executor.submit(self._start, factory)
+        browser = future.result()
+        if prefetch:
+            self.next = self.executor.submit(self._start, factory)
+            self.next_key = key
+        return browser
+
+    def release(self, browser):
+        """
+        Quit the browser in background.
+        """
+        self.executor.submit(self._quit, browser)
+
+    def close(self):
+        """
+        Quit the browser started in advance and wait for all quits. Safe to call many times.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.next is not None and not self.next.cancel():
+            try:
+                # start waits for a free session, it may never come if a leased browser is not released
+                self._quit(self.next.result(timeout=self.CLOSE_TIMEOUT))
+            except Exception as e:
+                logger.warning('Browser started in advance failed: %r', e)
+            self.next = None
+        self.executor.shutdown(wait=True)
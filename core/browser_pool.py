@@ -0,0 +1,146 @@
+"""
+Pool of long-lived browsers of one worker process.
+A scenario leases a browser and releases it at its end. Released browser is reset (extra tabs closed,
+cookies, cache and storages cleared, window size restored, about:blank opened) and waits for the next lease.
+Browser is recycled (quit, a new one is started on demand) after max_uses leases, after a failed scenario
+or when reset or health check fails.
+With "--mode inprocess" of parallel_runner.py the pool outlives behave runs, so one browser serves
+many features of the worker; browsers are quit when the worker process exits.
+"""
+from multiprocessing import util
+from selenium.common.exceptions import WebDriverException
+
+from core.browser_state import reset_browser_state
+
+import threading
+import logging
+import atexit
+import time
+
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SIZE = (1920, 1080)
+
+# pool of the current worker (process, or thread with "--mode thread"), see worker_pool
+_local = threading.local()
+
+
+def worker_pool(max_uses=20):
+    """
+    Pool of the current worker, created on first call.
+    :param max_uses: int - leases of one browser before it is recycled
+    :return: BrowserPool
+    """
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = BrowserPool(max_uses)
+        # pool workers of multiprocessing exit without atexit handlers, but run finalizers
+        util.Finalize(pool, pool.close, exitpriority=10)
+        atexit.register(pool.close)
+    return pool
+
+
+def _reset(browser):
+    """
+    Bring the browser to the state of a freshly started one.
+    """
+    handles = browser.window_handles
+    for handle in handles[1:]:
+        browser.switch_to.window(handle)
+        browser.close()
+    browser.switch_to.window(handles[0])
+    reset_browser_state(browser)
+    browser.set_window_size(*WINDOW_SIZE)
+    browser.get('about:blank')
+
+
+def _healthy(browser):
+    try:
+        browser.window_handles
+        return True
+    except WebDriverException:
+        return False
+
+
+class BrowserPool(object):
+    """
+    Idle browsers with their use counts. Not thread-safe, one pool per worker.
+    """
+
+    def __init__(self, max_uses=20):
+        self.max_uses = max_uses
+        self.idle = []
+        self.uses = {}
+        self.keys = {}
+        self.leased = set()
+        self.started = 0
+        self.recycled = 0
+
+    def lease(self, factory, key=None):
+        """
+        Idle healthy browser started with the same key or a new one.
+        :param factory: function - starts a new browser
+        :param key: str - kind of the browser (launch profile), browsers of other kinds are not leased
+        :return: selenium.webdriver.*
+        """
+        for browser in [browser for browser in reversed(self.idle) if self.keys.get(browser) == key]:
+            self.idle.remove(browser)
+            if _healthy(browser):
+                self.leased.add(browser)
+                return browser
+            logger.info('Idle browser is not responding, recycling it')
+            self._quit(browser)
+
+        start = time.time()
+        browser = factory()
+        self.started += 1
+        self.uses[browser] = 0
+        self.keys[browser] = key
+        self.leased.add(browser)
+        logger.info('Browser started for the pool in %.2fs', time.time() - start)
+        return browser
+
+    def release(self, browser, failed=False):
+        """
+        Return leased browser to the pool.
+        :param failed: boolean - scenario failed, the browser state is unknown and it is recycled
+        """
+        self.leased.discard(browser)
+        self.uses[browser] = self.uses.get(browser, 0) + 1
+
+        if failed or self.uses[browser] >= self.max_uses:
+            logger.info('Recycling browser after %s uses%s', self.uses[browser], ', failed' if failed else '')
+            self._quit(browser)
+            return
+
+        start = time.time()
+        try:
+            _reset(browser)
+        except WebDriverException as e:
+            logger.info('Failed to reset browser, recycling it: %s', e.msg)
+            self._quit(browser)
+            return
+        logger.debug('Browser is reset in %.3fs', time.time() - start)
+        self.idle.append(browser)
+
+    def _quit(self, browser):
+        self.recycled += 1
+        self.uses.pop(browser, None)
+        self.keys.pop(browser, None)
+        try:
+            browser.quit()
+        except Exception as e:
+            logger.warning('Failed to quit browser: %r', e)
+
+    def close(self):
+        """
+        Quit all browsers of the pool, also leased ones. Safe to call many times.
+        """
+        browsers = self.idle + list(self.leased)
+        self.idle = []
+        self.leased = set()
+        for browser in browsers:
+            self._quit(browser)
+        if browsers:
+            logger.info('Browser pool closed: %s browsers started, %s quit', self.started, self.recycled)
@@ -0,0 +1,71 @@
+"""
+Reset of cookies, cache and storages of a browser, so it can be reused by the next scenario.
+Chrome is reset by DevTools commands, other browsers (Firefox, Remote) by WebDriver cookies API
+and clearing storages of the current origin with JavaScript.
+"""
+from selenium.common.exceptions import WebDriverException
+
+from core import scripts
+
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+CDP = 'cdp'
+SCRIPT = 'script'
+
+
+def _current_origin(browser):
+    try:
+        origin = browser.execute_script('return window.location.origin;')
+    except WebDriverException:
+        return None
+    # about:blank, data: and file: pages have no origin
+    return origin if origin and origin.startswith('http') else None
+
+
+def _reset_by_cdp(browser, origins):
+    browser.execute_cdp_cmd('Network.clearBrowserCache', {})
+    browser.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    for origin in origins:
+        browser.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+
+
+def _reset_by_script(browser, origins):
+    """
+    HTTP cache of the browser can't be cleared this way, storages are cleared for the current origin only.
+    """
+    browser.delete_all_cookies()
+    if _current_origin(browser):
+        browser.execute_async_script(scripts.CLEAR_STORAGE)
+    if set(origins) - {_current_origin(browser)}:
+        logger.debug('Storages of other origins are not cleared without DevTools: %s', origins)
+
+
+def reset_browser_state(browser, origins=()):
+    """
+    Clear cookies, cache and storages of the browser in milliseconds instead of relaunching it.
+    :param browser: selenium.webdriver.*
+    :param origins: list of str - origins to clear storages of (e.g. "https://github.com"), current one is always cleared
+    :return: str - CDP or SCRIPT, the way the browser was reset
+    """
+    start = time.time()
+    origins = list(origins)
+    origin = _current_origin(browser)
+    if origin and origin not in origins:
+        origins.append(origin)
+
+    way = SCRIPT
+    if hasattr(browser, 'execute_cdp_cmd'):
+        try:
+            _reset_by_cdp(browser, origins)
+            way = CDP
+        except WebDriverException as e:
+            logger.debug('DevTools reset failed, clearing by script: %s', e.msg)
+    if way == SCRIPT:
+        _reset_by_script(browser, origins)
+
+    logger.debug('Browser state reset by %s in %.3fs', way, time.time() - start)
+    return way
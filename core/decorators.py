@@ -1,6 +1,9 @@
 from functools import wraps
+from selenium.common.exceptions import StaleElementReferenceException
 import logging
 
+from core import profiler
+
 
 def log_exception(message, logger=None):
     """
@@ -16,9 +19,41 @@ def log_exception(message, logger=None):
                 log = logger
             assert isinstance(log, logging.Logger)
             try:
-                return func(*args, **kwargs)
+                if profiler.active() is None:
+                    return func(*args, **kwargs)
+                with profiler.active().action(func.__name__):
+                    return func(*args, **kwargs)
             except Exception:
-                log.error(message.format(args[1]))
+                log.error(message.format(args[1] if len(args) > 1 else ''))
                 raise
         return wrapper
     return decorator
+
+
+def retry_on_stale(func):
+    """
+    Decorator for BaseClass actions: if a cached web element turned out stale, forget cached elements
+    and run the action once more with freshly found ones
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        except StaleElementReferenceException:
+            self.logger.debug('Web element is stale, trying again with fresh elements')
+            self.cached_elements.invalidate()
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def changes_page(func):
+    """
+    Decorator for BaseClass actions which may change the page: cached web elements are forgotten after them
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.cached_elements.invalidate()
+    return wrapper
@@ -0,0 +1,221 @@
+"""
+Browser factory of one worker process.
+Local Chrome sessions share one chromedriver Service started once per worker, instead of starting
+a new chromedriver executable for every browser. Sessions are launched with named profiles:
+    default  - Config.CHROME_OPTIONS as is
+    headless - headless Chrome with Full HD window
+    fast     - headless without GPU, extensions, background networking and first run tasks
+More profiles can be defined in config.ini sections [PROFILE <name>] with keys:
+    Extends          - profile to start from
+    Arguments        - Chrome arguments, one per line
+    UserDataTemplate - folder copied as user data dir of every session (prepared cookies, settings, extensions)
+Profile is chosen per run (LaunchProfile in [BROWSER] of config.ini or "-D launch_profile=<name>")
+or per scenario with @profile:<name> tag. Startup time of every session is kept per profile.
+"""
+from multiprocessing import util
+from selenium import webdriver
+from selenium.webdriver.chrome.remote_connection import ChromeRemoteConnection
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
+
+from utilities.config import Config
+
+import threading
+import tempfile
+import logging
+import shutil
+import atexit
+import copy
+import time
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TAG = 'profile'
+DEFAULT_PROFILE = 'default'
+
+HEADLESS_ARGUMENTS = ['--headless', '--window-size=1920,1080']
+
+PROFILES = {
+    DEFAULT_PROFILE: {'arguments': []},
+    'headless': {'arguments': HEADLESS_ARGUMENTS},
+    'fast': {'arguments': HEADLESS_ARGUMENTS + [
+        '--disable-gpu',
+        '--disable-extensions',
+        '--disable-dev-shm-usage',
+        '--disable-background-networking',
+        '--disable-default-apps',
+        '--disable-sync',
+        '--disable-translate',
+        '--metrics-recording-only',
+        '--mute-audio',
+        '--no-first-run',
+        '--no-default-browser-check',
+    ]},
+}
+
+
+def _load_profiles():
+    """
+    Built-in profiles extended with [PROFILE <name>] sections of config.ini.
+    """
+    profiles = copy.deepcopy(PROFILES)
+    for section in Config.config.sections():
+        if not section.startswith('PROFILE '):
+            continue
+        name = section[len('PROFILE '):].strip()
+        base = profiles.get(Config.config.get(section, 'Extends', fallback=DEFAULT_PROFILE), {'arguments': []})
+        arguments = Config.config.get(section, 'Arguments', fallback='').split('\n')
+        profiles[name] = {
+            'arguments': base['arguments'] + [argument.strip() for argument in arguments if argument.strip()],
+            'user_data_template': Config.config.get(section, 'UserDataTemplate',
+                                                    fallback=base.get('user_data_template')),
+        }
+    return profiles
+
+
+def scenario_profile(scenario, default=None):
+    """
+    Launch profile of the scenario: from @profile:<name> tag or the run default.
+    :type scenario: behave.model.Scenario
+    :param default: str - profile of the run, if None takes Config.LAUNCH_PROFILE
+    :return: str
+    """
+    for tag in scenario.effective_tags:
+        parts = tag.split(':', 1)
+        if parts[0] == PROFILE_TAG and len(parts) == 2 and parts[1]:
+            return parts[1]
+    return default or Config.LAUNCH_PROFILE
+
+
+class SharedServiceChrome(webdriver.Chrome):
+    """
+    Chrome session of an already started chromedriver Service. Quit ends the session, not the service.
+    """
+
+    def __init__(self, service, options, desired_capabilities=None, keep_alive=True, user_data_dir=None):
+        """
+        :param service: selenium.webdriver.chrome.service.Service - started service
+        :param options: selenium.webdriver.ChromeOptions
+        :param desired_capabilities: dict - merged with options, e.g. Config.CAPABILITIES
+        :param user_data_dir: str - temporary user data dir removed on quit
+        """
+        capabilities = dict(desired_capabilities or {})
+        capabilities.update(options.to_capabilities())
+        self.service = service
+        self.user_data_dir = user_data_dir
+        RemoteWebDriver.__init__(
+            self,
+            command_executor=ChromeRemoteConnection(remote_server_addr=service.service_url, keep_alive=keep_alive),
+            desired_capabilities=capabilities)
+        self._is_remote = False
+
+    def quit(self):
+        try:
+            RemoteWebDriver.quit(self)
+        finally:
+            if self.user_data_dir:
+                shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+# factory of the current worker process, see worker_factory
+_factory = None
+_factory_lock = threading.Lock()
+
+
+def worker_factory():
+    """
+    Factory of the current process, created on first call. Its chromedriver is stopped when the process exits.
+    :return: DriverFactory
+    """
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            _factory = DriverFactory()
+            # pool workers of multiprocessing exit without atexit handlers, but run finalizers
+            util.Finalize(_factory, _factory.close, exitpriority=5)
+            atexit.register(_factory.close)
+        return _factory
+
+
+class DriverFactory(object):
+    """
+    Starts local Chrome sessions with launch profiles against one chromedriver.
+    """
+
+    def __init__(self):
+        self.profiles = _load_profiles()
+        self.service = None
+        self.startups = {}
+        # behave runs of "--mode thread" share the factory and its chromedriver
+        self.lock = threading.Lock()
+
+    def chrome_service(self):
+        """
+        Started chromedriver service of the worker, restarted if the process died.
+        """
+        with self.lock:
+            if self.service is None or self.service.process is None or self.service.process.poll() is not None:
+                start = time.time()
+                self.service = Service(Config.CHROMEDRIVER)
+                self.service.start()
+                logger.info('chromedriver started at %s in %.2fs', self.service.service_url, time.time() - start)
+            return self.service
+
+    def chrome_options(self, profile):
+        """
+        Config.CHROME_OPTIONS with arguments of the profile.
+        :return: (selenium.webdriver.ChromeOptions, temporary user data dir or None)
+        """
+        if profile not in self.profiles:
+            raise ValueError('Unknown launch profile {}, known are: {}'.format(profile, ', '.join(self.profiles)))
+
+        options = copy.deepcopy(Config.CHROME_OPTIONS)
+        for argument in self.profiles[profile]['arguments']:
+            if argument not in options.arguments:
+                options.add_argument(argument)
+
+        user_data_dir = None
+        template = self.profiles[profile].get('user_data_template')
+        if template:
+            user_data_dir = tempfile.mkdtemp(prefix='chrome_profile_')
+            # copytree needs a missing destination
+            shutil.rmtree(user_data_dir)
+            shutil.copytree(template, user_data_dir)
+            options.add_argument('--user-data-dir={}'.format(user_data_dir))
+        return options, user_data_dir
+
+    def chrome(self, profile=DEFAULT_PROFILE):
+        """
+        New Chrome session with the profile, Config.CAPABILITIES (performance log) included.
+        :return: SharedServiceChrome
+        """
+        start = time.time()
+        options, user_data_dir = self.chrome_options(profile)
+        try:
+            browser = SharedServiceChrome(self.chrome_service(), options, copy.deepcopy(Config.CAPABILITIES),
+                                          user_data_dir=user_data_dir)
+        except Exception:
+            if user_data_dir:
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+            raise
+        self.record_startup(profile, time.time() - start)
+        return browser
+
+    def record_startup(self, profile, seconds):
+        self.startups.setdefault(profile, []).append(seconds)
+        logger.info('Browser with profile %s started in %.2fs', profile, seconds)
+
+    def report(self):
+        """
+        :return: dict - {profile: (sessions count, average startup, max startup)}
+        """
+        return {profile: (len(times), sum(times) / len(times), max(times)) for profile, times in self.startups.items()}
+
+    def close(self):
+        for profile, (count, average, maximum) in self.report().items():
+            logger.info('Profile %s: %s sessions, startup avg %.2fs, max %.2fs', profile, count, average, maximum)
+        self.startups = {}
+        if self.service is not None:
+            self.service.stop()
+            self.service = None
@@ -0,0 +1,93 @@
+"""
+Cache of web elements already found by BaseClass, shared by all pages of one browser.
+Page objects often look up the same xpath several times in a row (wait for it, then read it),
+every lookup is a find round trip and usually one more to check the condition.
+Cached element is rechecked against the condition of the new lookup, presence included (one round trip,
+which also detects elements removed from the page by scripts). Cache lives till the next action which may
+change the page (navigation, click, typing, switches) or till any cached element turns out stale.
+"""
+from selenium.webdriver.support import expected_conditions as ec
+from selenium.common.exceptions import StaleElementReferenceException
+
+import weakref
+
+
+def _present(element):
+    # raises StaleElementReferenceException if the element is no longer attached to the page
+    return element.tag_name is not None
+
+
+def _displayed(element):
+    return element.is_displayed()
+
+
+def _clickable(element):
+    return element.is_displayed() and element.is_enabled()
+
+
+# conditions which return the element itself and the check of the already found element for them
+CHECKS = {
+    ec.presence_of_element_located: _present,
+    ec.visibility_of_element_located: _displayed,
+    ec.element_to_be_clickable: _clickable,
+}
+
+# caches of browsers, dropped with the browser
+_caches = weakref.WeakKeyDictionary()
+
+
+def for_browser(browser):
+    """
+    :param browser: selenium.webdriver.*
+    :return: ElementCache shared by all pages of the browser
+    """
+    cache = _caches.get(browser)
+    if cache is None:
+        cache = _caches[browser] = ElementCache()
+    return cache
+
+
+class ElementCache(object):
+    """
+    Elements found by (xpath, condition) in the current page generation.
+    """
+
+    def __init__(self):
+        self.elements = {}
+        self.generation = 0
+        self.hits = 0
+
+    def get(self, xpath, condition):
+        """
+        Element found before by the same xpath with the same condition or just present,
+        if it still satisfies the condition.
+        :return: WebElement or None if it has to be found again
+        """
+        if condition not in CHECKS:
+            return None
+
+        for key in ((xpath, condition), (xpath, ec.presence_of_element_located)):
+            element = self.elements.get(key)
+            if element is None:
+                continue
+            check = CHECKS[condition]
+            try:
+                if check(element):
+                    self.hits += 1
+                    return element
+            except StaleElementReferenceException:
+                self.invalidate()
+                return None
+        return None
+
+    def put(self, xpath, condition, element):
+        if condition in CHECKS and element is not None and element is not True:
+            self.elements[(xpath, condition)] = element
+
+    def invalidate(self):
+        """
+        Page is changed, forget all elements.
+        """
+        if self.elements:
+            self.elements = {}
+        self.generation += 1
@@ -0,0 +1,98 @@
+"""
+Buffer of DevTools events from the performance log of a browser, shared by all readers of one browser.
+WebDriver returns every performance log entry only once, so network policy savings, page timing
+reports and others read events from this buffer instead of the browser.
+Performance log is written only by Chrome started with Config.CAPABILITIES (goog:loggingPrefs),
+for other browsers the buffer stays empty.
+"""
+from selenium.common.exceptions import WebDriverException
+
+import weakref
+import json
+
+
+# buffers of browsers, dropped with the browser
+_logs = weakref.WeakKeyDictionary()
+
+
+def for_browser(browser):
+    """
+    :param browser: selenium.webdriver.*
+    :return: NetworkLog of the browser
+    """
+    log = _logs.get(browser)
+    if log is None:
+        log = _logs[browser] = NetworkLog(browser)
+    return log
+
+
+class NetworkLog(object):
+    """
+    DevTools events (Network.*, Page.*) of the current scenario.
+    """
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.events = []
+        self.supported = True
+
+    def collect(self):
+        """
+        Move new entries of the performance log into the buffer.
+        :return: list of dict - all buffered events: method, params, timestamp (ms)
+        """
+        if not self.supported:
+            return self.events
+        try:
+            entries = self.browser.get_log('performance')
+        except WebDriverException:
+            # browser without performance log
+            self.supported = False
+            return self.events
+
+        for entry in entries:
+            message = json.loads(entry['message'])['message']
+            if message['method'].startswith(('Network.', 'Page.')):
+                self.events.append({'method': message['method'], 'params': message.get('params', {}),
+                                    'timestamp': entry['timestamp']})
+        return self.events
+
+    def clear(self):
+        """
+        Drop events collected so far and waiting in the browser, e.g. at the start of a scenario.
+        """
+        self.collect()
+        self.events = []
+
+    def requests(self):
+        """
+        Network requests of the buffered events merged by request id.
+        :return: dict - {request id: dict with url, type, status, size, blocked, failed and timestamps}
+        """
+        requests = {}
+        for event in self.collect():
+            params = event['params']
+            if 'requestId' not in params:
+                continue
+            request = requests.setdefault(params['requestId'], {'url': None, 'type': None, 'status': None,
+                                                                'size': 0, 'blocked': False, 'failed': False})
+            method = event['method']
+            if method == 'Network.requestWillBeSent':
+                request['url'] = params['request']['url']
+                request['method'] = params['request']['method']
+                request['type'] = params.get('type')
+                request['started'] = params.get('timestamp')
+                request['wall_time'] = params.get('wallTime')
+            elif method == 'Network.responseReceived':
+                request['status'] = params['response']['status']
+                request['mime_type'] = params['response'].get('mimeType')
+                request['timing'] = params['response'].get('timing')
+            elif method == 'Network.loadingFinished':
+                request['size'] = params.get('encodedDataLength', 0)
+                request['finished'] = params.get('timestamp')
+            elif method == 'Network.loadingFailed':
+                request['failed'] = True
+                # "inspector" - blocked by Network.setBlockedURLs
+                request['blocked'] = params.get('blockedReason') == 'inspector'
+                request['finished'] = params.get('timestamp')
+        return requests
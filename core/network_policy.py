@@ -0,0 +1,178 @@
+"""
+Tag-driven blocking of network requests the scenario never asserts on (images, fonts, analytics, ads).
+Every key of [NETWORK] section of config.ini is a scenario tag with URL patterns (one per line,
+"*" is a wildcard) blocked for scenarios with this tag, built-in policies are used when a key is missing:
+    @no-images, @no-fonts, @no-media, @block-third-party
+Chrome blocks the patterns by DevTools Network.setBlockedURLs before the scenario, patterns match the whole URL
+(query string included), so extension patterns end with "*"; images served without extension are blocked by host.
+Scenarios without policy tags don't touch DevTools, unless their browser still blocks patterns of an earlier scenario.
+Firefox has no URL blocking, its prefs disable images and web fonts at browser start instead.
+Bytes saved are estimated by sizes of the same URLs loaded by other scenarios (with policies or page timings),
+kept in a JSON file.
+"""
+from selenium.common.exceptions import WebDriverException
+
+from utilities.config import Config
+
+import threading
+import logging
+import weakref
+import json
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# sizes of resources loaded by earlier scenarios and runs, see ResourceSizes
+SIZES_FILE = '.network_sizes.json'
+
+POLICIES = {
+    'no-images': [
+        '*.png*', '*.jpg*', '*.jpeg*', '*.gif*', '*.webp*', '*.svg*', '*.ico*', '*.avif*',
+        # image hosts serving files without extension, e.g. avatars.githubusercontent.com/u/1?s=40
+        '*avatars.githubusercontent.com*',
+        '*camo.githubusercontent.com*',
+        '*user-images.githubusercontent.com*',
+        '*gravatar.com/avatar*',
+    ],
+    'no-fonts': ['*.woff*', '*.ttf*', '*.otf*', '*.eot*'],
+    'no-media': ['*.mp4*', '*.webm*', '*.ogg*', '*.mp3*', '*.wav*'],
+    'block-third-party': [
+        '*google-analytics.com*',
+        '*googletagmanager.com*',
+        '*doubleclick.net*',
+        '*googlesyndication.com*',
+        '*facebook.net*',
+        '*hotjar.com*',
+        '*segment.io*',
+        '*optimizely.com*',
+        '*fonts.googleapis.com*',
+        '*fonts.gstatic.com*',
+    ],
+}
+
+# prefs of Firefox doing the same as some of the policies, applied when the browser starts
+FIREFOX_PREFS = {
+    'no-images': {'permissions.default.image': 2},
+    'no-fonts': {'gfx.downloadable_fonts.enabled': False},
+    'no-media': {'media.autoplay.default': 5},
+}
+
+
+def load_policies():
+    """
+    Built-in policies overridden and extended by [NETWORK] section of config.ini.
+    :return: dict - {tag: list of URL patterns}
+    """
+    policies = dict(POLICIES)
+    if Config.config.has_section('NETWORK'):
+        for tag, patterns in Config.config.items('NETWORK'):
+            policies[tag] = [pattern.strip() for pattern in patterns.split('\n') if pattern.strip()]
+    return policies
+
+
+def scenario_policies(scenario, policies):
+    """
+    :type scenario: behave.model.Scenario
+    :param policies: dict - from load_policies
+    :return: list of str - tags of policies applied to the scenario
+    """
+    return sorted(tag for tag in set(scenario.effective_tags) if tag in policies)
+
+
+def firefox_prefs(tags):
+    """
+    :param tags: list of str - policy tags
+    :return: dict - Firefox prefs of the policies, policies without prefs are not applied
+    """
+    prefs = {}
+    for tag in tags:
+        if tag not in FIREFOX_PREFS:
+            logger.warning('Policy @%s has no Firefox prefs, its requests are not blocked', tag)
+        prefs.update(FIREFOX_PREFS.get(tag, {}))
+    return prefs
+
+
+# browsers with patterns blocked, they must be unblocked before a scenario without policies
+_blocking = weakref.WeakSet()
+
+
+def needs_apply(browser, patterns):
+    """
+    :return: boolean - True if patterns must be sent to the browser, False if it blocks nothing and nothing is asked
+    """
+    return bool(patterns) or browser in _blocking
+
+
+def apply(browser, patterns):
+    """
+    Block URL patterns in Chrome for the next scenario, empty list unblocks everything.
+    :param browser: selenium.webdriver.*
+    :param patterns: list of str
+    :return: boolean - True if patterns are applied, False if the browser has no DevTools
+    """
+    if not hasattr(browser, 'execute_cdp_cmd'):
+        return False
+    try:
+        browser.execute_cdp_cmd('Network.enable', {})
+        browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(patterns)})
+    except WebDriverException as e:
+        logger.warning('Failed to block URLs: %s', e.msg)
+        return False
+    if patterns:
+        _blocking.add(browser)
+    else:
+        _blocking.discard(browser)
+    return True
+
+
+def _url_key(url):
+    # cache busting query strings of analytics differ on every load
+    return url.split('?', 1)[0]
+
+
+class ResourceSizes(object):
+    """
+    Sizes of loaded resources by URL, stored as JSON file between runs.
+    File is replaced atomically, parallel workers lose only each other's latest sizes.
+    """
+    # URLs kept in the file, the least recently measured are dropped
+    LIMIT = 20000
+
+    def __init__(self, path):
+        self.path = path
+        self.sizes = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as sizes_file:
+                    self.sizes = json.load(sizes_file)
+            except ValueError:
+                logger.warning('Resource sizes file %s is broken, starting from scratch', path)
+
+    def update(self, requests):
+        """
+        :param requests: dict - from core.network_log.NetworkLog.requests
+        """
+        for request in requests.values():
+            if request['url'] and request['size'] and not request['failed']:
+                key = _url_key(request['url'])
+                self.sizes.pop(key, None)
+                self.sizes[key] = request['size']
+
+    def savings(self, requests):
+        """
+        :param requests: dict - from core.network_log.NetworkLog.requests
+        :return: (blocked requests, estimated bytes saved, blocked requests of unknown size)
+        """
+        blocked = [request for request in requests.values() if request['blocked'] and request['url']]
+        known = [self.sizes[_url_key(request['url'])] for request in blocked if _url_key(request['url']) in self.sizes]
+        return len(blocked), sum(known), len(blocked) - len(known)
+
+    def save(self):
+        if not self.path:
+            return
+        sizes = dict(list(self.sizes.items())[-self.LIMIT:])
+        tmp_path = '{}.{}.{}.tmp'.format(self.path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as sizes_file:
+            json.dump(sizes, sizes_file)
+        os.replace(tmp_path, self.path)
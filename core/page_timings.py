@@ -0,0 +1,223 @@
+"""
+Opt-in page timings collector (enable with "-D page_timings=true" or PageTimings=True in config.ini).
+After every step the page open in the browser is measured by Navigation and Resource Timing,
+at the end of the scenario its pages and requests are written to logs/<scenario>/network.har.json,
+a compact HAR (no headers and bodies). Requests come from DevTools events of the performance log
+when the browser writes it (local Chrome), from Resource Timing of the measured pages otherwise.
+Steps of tests/UI/features/steps/performance_steps.py check page-load budgets with current_page.
+"""
+from prettytable import PrettyTable
+from selenium.common.exceptions import WebDriverException
+
+from core import network_log
+from core import scripts
+
+import datetime
+import logging
+import json
+import time
+import os
+
+
+HAR_FILE = 'network.har.json'
+
+# metrics of current_page in seconds, None until the page reaches them
+METRICS = ('ttfb', 'dom_content_loaded', 'load')
+
+
+def _seconds(navigation, key):
+    if not navigation or not navigation.get(key):
+        return None
+    return round((navigation[key] - navigation['startTime']) / 1000, 3)
+
+
+def current_page(browser):
+    """
+    Timings of the page open in the browser.
+    :param browser: selenium.webdriver.*
+    :return: dict - url, title, time_origin (epoch ms), ttfb, dom_content_loaded, load (seconds or None),
+        requests, transfer_size (bytes of the document and its resources), raw navigation and resources entries
+    """
+    timings = browser.execute_script(scripts.PAGE_TIMINGS)
+    navigation = timings['navigation']
+    entries = ([navigation] if navigation else []) + timings['resources']
+    return {
+        'url': timings['url'],
+        'title': timings['title'],
+        'time_origin': timings['timeOrigin'],
+        'ttfb': _seconds(navigation, 'responseStart'),
+        'dom_content_loaded': _seconds(navigation, 'domContentLoadedEventEnd'),
+        'load': _seconds(navigation, 'loadEventEnd'),
+        'requests': len(entries),
+        'transfer_size': sum(entry.get('transferSize') or 0 for entry in entries),
+        'navigation': navigation,
+        'resources': timings['resources'],
+    }
+
+
+def wait_for_metric(browser, metric, timeout):
+    """
+    Wait until the page open in the browser reaches the metric.
+    :param metric: str - one of METRICS
+    :param timeout: float - seconds
+    :return: dict - current_page, its metric is None if not reached within timeout
+    """
+    end = time.time() + timeout
+    page = current_page(browser)
+    while page[metric] is None and time.time() < end:
+        time.sleep(0.1)
+        page = current_page(browser)
+    return page
+
+
+def _iso(epoch_ms):
+    return datetime.datetime.fromtimestamp(epoch_ms / 1000, datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+
+def _blocked(timing):
+    # time in the queue before DNS lookup, connection or sending, whichever comes first
+    for key in ('dnsStart', 'connectStart', 'sendStart'):
+        if timing.get(key, -1) >= 0:
+            return round(timing[key], 3)
+    return -1
+
+
+def _span(start, end):
+    return round(end - start, 3) if start is not None and end is not None and start >= 0 and end >= start else -1
+
+
+class PageTimings(object):
+    """
+    Pages of one scenario measured in one browser.
+    """
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.pages = {}
+        self.logger = logging.getLogger(__name__)
+        # events of previous scenarios of a reused browser are dropped
+        self.network = network_log.for_browser(browser)
+        self.network.clear()
+
+    def capture(self):
+        """
+        Measure the page open in the browser, measures of the same page are replaced by the latest one.
+        """
+        try:
+            page = current_page(self.browser)
+        except WebDriverException as e:
+            # alert is open, browser is closed, etc.
+            self.logger.debug('Page timings are not captured: %s', e.msg)
+            return
+        if page['navigation']:
+            self.pages[page['time_origin']] = page
+
+    def _sorted_pages(self):
+        return sorted(self.pages.values(), key=lambda page: page['time_origin'])
+
+    def _har_pages(self):
+        return [{
+            'id': 'page_{}'.format(number),
+            'title': page['title'] or page['url'],
+            'startedDateTime': _iso(page['time_origin']),
+            'pageTimings': {
+                'onContentLoad': round(page['dom_content_loaded'] * 1000) if page['dom_content_loaded'] else -1,
+                'onLoad': round(page['load'] * 1000) if page['load'] else -1,
+            },
+            '_url': page['url'],
+            '_ttfb': page['ttfb'],
+            '_requests': page['requests'],
+            '_transferSize': page['transfer_size'],
+        } for number, page in enumerate(self._sorted_pages(), 1)]
+
+    def _pageref(self, pages, epoch_ms):
+        # the latest page started before the request
+        refs = [har_page['id'] for page, har_page in zip(self._sorted_pages(), pages)
+                if page['time_origin'] <= epoch_ms]
+        return refs[-1] if refs else None
+
+    def _devtools_entries(self, pages):
+        entries = []
+        for request in self.network.requests().values():
+            if not request['url'] or request.get('wall_time') is None or request['url'].startswith('data:'):
+                continue
+            timing = request.get('timing') or {}
+            send_end = timing.get('sendEnd')
+            headers_end = timing.get('receiveHeadersEnd')
+            total = _span(request.get('started'), request.get('finished'))
+            total = round(total * 1000, 3) if total >= 0 else -1
+            receive = round(total - headers_end, 3) if total >= 0 and headers_end is not None else -1
+            entries.append({
+                'pageref': self._pageref(pages, request['wall_time'] * 1000),
+                'startedDateTime': _iso(request['wall_time'] * 1000),
+                'time': total,
+                'request': {'method': request.get('method'), 'url': request['url']},
+                'response': {'status': request['status'] or 0, 'mimeType': request.get('mime_type'),
+                             '_transferSize': request['size']},
+                'timings': {
+                    'blocked': _blocked(timing),
+                    'dns': _span(timing.get('dnsStart'), timing.get('dnsEnd')),
+                    'connect': _span(timing.get('connectStart'), timing.get('connectEnd')),
+                    'ssl': _span(timing.get('sslStart'), timing.get('sslEnd')),
+                    'send': _span(timing.get('sendStart'), send_end),
+                    'wait': _span(send_end, headers_end),
+                    'receive': receive,
+                },
+                '_type': request['type'],
+                '_failed': request['failed'],
+                '_blocked': request['blocked'],
+            })
+        return sorted(entries, key=lambda entry: entry['startedDateTime'])
+
+    def _resource_timing_entries(self, pages):
+        entries = []
+        for page, har_page in zip(self._sorted_pages(), pages):
+            for entry in [page['navigation']] + page['resources']:
+                entries.append({
+                    'pageref': har_page['id'],
+                    'startedDateTime': _iso(page['time_origin'] + entry['startTime']),
+                    'time': round(entry['duration'], 3),
+                    'request': {'method': 'GET', 'url': entry['name']},
+                    'response': {'status': 0, 'mimeType': None, '_transferSize': entry.get('transferSize') or 0},
+                    'timings': {
+                        'blocked': _span(entry['startTime'], entry['domainLookupStart'] or entry['requestStart']),
+                        'dns': _span(entry['domainLookupStart'], entry['domainLookupEnd']),
+                        'connect': _span(entry['connectStart'], entry['connectEnd']),
+                        'ssl': _span(entry['secureConnectionStart'] or None, entry['connectEnd']),
+                        'send': 0,
+                        # zeros of cross-origin resources without Timing-Allow-Origin are unknown
+                        'wait': _span(entry['requestStart'] or None, entry['responseStart'] or None),
+                        'receive': _span(entry['responseStart'] or None, entry['responseEnd']),
+                    },
+                    '_type': entry.get('initiatorType', 'document'),
+                })
+        return entries
+
+    def report(self, report_dir):
+        """
+        Write pages and requests of the scenario to <report_dir>/network.har.json.
+        :param report_dir: str - folder of the scenario logs
+        :return: list of dict - HAR pages
+        """
+        self.capture()
+        pages = self._har_pages()
+        try:
+            entries = self._devtools_entries(pages)
+        except Exception as e:
+            self.logger.warning('Failed to read DevTools network events: %r', e)
+            entries = []
+        if not self.network.supported or not entries:
+            entries = self._resource_timing_entries(pages)
+
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        with open(os.path.join(report_dir, HAR_FILE), 'w') as har_file:
+            json.dump({'log': {'version': '1.2', 'creator': {'name': __name__, 'version': '1.0'},
+                               'pages': pages, 'entries': entries}}, har_file, indent=1)
+
+        table = PrettyTable(['Page', 'TTFB (s)', 'DOMContentLoaded (s)', 'Load (s)', 'Requests', 'KB'])
+        for page in self._sorted_pages():
+            table.add_row([page['url']] + ['-' if page[metric] is None else page[metric] for metric in METRICS] +
+                          [page['requests'], round(page['transfer_size'] / 1024, 1)])
+        self.logger.info('Page timings:\n%s', table)
+        return pages
@@ -0,0 +1,205 @@
+"""
+Opt-in profiler of WebDriver commands (enable with "-D profile=true" or Profile=True in config.ini).
+Wraps command executor of the browser and records every wire protocol command with its latency
+and payload size, every BaseClass.sleep and time spent in explicit waits, grouped by step and scenario.
+Step time is split into sleeping (deliberate sleeps), waiting (explicit waits for elements, including
+their polling) and working (everything else: commands, page loads, python code).
+"""
+from contextlib import contextmanager
+from prettytable import PrettyTable
+
+import threading
+import logging
+import json
+import time
+import os
+
+
+# step name of commands sent from hooks, out of any step
+HOOKS = '<hooks>'
+
+# profiler of the current thread (behave runs of "--mode thread" have their own), see enable
+_local = threading.local()
+
+
+def enable():
+    if getattr(_local, 'profiler', None) is None:
+        _local.profiler = CommandProfiler()
+    return _local.profiler
+
+
+def active():
+    """
+    :return: CommandProfiler or None if profiling is not enabled
+    """
+    return getattr(_local, 'profiler', None)
+
+
+@contextmanager
+def waiting():
+    """
+    Mark a block as waiting for the page (explicit waits), no-op when profiling is not enabled.
+    """
+    profiler = active()
+    if profiler is None:
+        yield
+    else:
+        with profiler.waiting():
+            yield
+
+
+def _size(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class CommandProfiler(object):
+    """
+    Commands, sleeps and waits of the current scenario.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.scenario = None
+        self._reset()
+
+    def _reset(self):
+        self.commands = []
+        self.steps = []
+        self.step = None
+        self.step_start = None
+        self.step_first_command = 0
+        self.actions = []
+        self._sleeping = 0.0
+        self._waiting = 0.0
+        self._waiting_depth = 0
+
+    def attach(self, browser):
+        """
+        Wrap command executor of the browser, every command goes through it. Safe to call many times.
+        :param browser: selenium.webdriver.*
+        """
+        executor = browser.command_executor
+        if getattr(executor, '_profiler_original', None) is not None:
+            return
+
+        original = executor.execute
+
+        def execute(command, params):
+            start = time.time()
+            response = None
+            try:
+                response = original(command, params)
+                return response
+            finally:
+                self.command(command, time.time() - start, _size(params), _size(response))
+
+        executor._profiler_original = original
+        executor.execute = execute
+
+    def start_scenario(self, name):
+        self.scenario = name
+        self._reset()
+
+    def start_step(self, name):
+        self._end_step()
+        self.step = name
+        self.step_start = time.time()
+        self.step_first_command = len(self.commands)
+        self._sleeping = 0.0
+        self._waiting = 0.0
+
+    def end_step(self):
+        self._end_step()
+        self.step = None
+
+    def _end_step(self):
+        if self.step is None:
+            return
+        duration = time.time() - self.step_start
+        self.steps.append({'step': self.step, 'duration': duration, 'sleeping': self._sleeping,
+                           'waiting': self._waiting, 'working': max(duration - self._sleeping - self._waiting, 0.0),
+                           'commands': len(self.commands) - self.step_first_command})
+
+    def command(self, name, latency, request_size, response_size):
+        self.commands.append({'step': self.step or HOOKS, 'action': self.actions[0] if self.actions else None,
+                              'command': name, 'latency': latency, 'waiting': self._waiting_depth > 0,
+                              'request_size': request_size, 'response_size': response_size})
+
+    def sleep(self, seconds):
+        """
+        Record BaseClass.sleep. Sleeps of polling loops inside waiting blocks are waiting time already.
+        """
+        if self._waiting_depth == 0:
+            self._sleeping += seconds
+
+    @contextmanager
+    def action(self, name):
+        """
+        Commands are attributed to the outermost BaseClass action which sent them.
+        """
+        self.actions.append(name)
+        try:
+            yield
+        finally:
+            self.actions.pop()
+
+    @contextmanager
+    def waiting(self):
+        self._waiting_depth += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._waiting_depth -= 1
+            if self._waiting_depth == 0:
+                self._waiting += time.time() - start
+
+    def top_commands(self, limit=10):
+        """
+        :return: list of (command, count, total latency, max latency, bytes sent and received), the slowest first
+        """
+        grouped = {}
+        for record in self.commands:
+            count, total, maximum, size = grouped.get(record['command'], (0, 0.0, 0.0, 0))
+            grouped[record['command']] = (count + 1, total + record['latency'], max(maximum, record['latency']),
+                                          size + record['request_size'] + record['response_size'])
+        return sorted(((name,) + values for name, values in grouped.items()), key=lambda row: row[2],
+                      reverse=True)[:limit]
+
+    def report(self, report_dir):
+        """
+        Write profile of the current scenario to <report_dir>/profile.txt and profile.json.
+        :param report_dir: str - folder of the scenario logs
+        :return: dict - total sleeping, waiting and working time of the scenario steps
+        """
+        self._end_step()
+        self.step = None
+        totals = {key: sum(step[key] for step in self.steps) for key in ('sleeping', 'waiting', 'working')}
+
+        steps_table = PrettyTable(['Step', 'Duration (s)', 'Sleeping (s)', 'Waiting (s)', 'Working (s)', 'Commands'])
+        for step in self.steps:
+            steps_table.add_row([step['step'], round(step['duration'], 3), round(step['sleeping'], 3),
+                                 round(step['waiting'], 3), round(step['working'], 3), step['commands']])
+
+        commands_table = PrettyTable(['Command', 'Count', 'Total (s)', 'Max (s)', 'Bytes'])
+        for name, count, total, maximum, size in self.top_commands():
+            commands_table.add_row([name, count, round(total, 3), round(maximum, 3), size])
+
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        with open(os.path.join(report_dir, 'profile.txt'), 'w') as report_file:
+            report_file.write('Scenario: {}\n'.format(self.scenario))
+            report_file.write('Sleeping: {sleeping:.3f}s, waiting: {waiting:.3f}s, working: {working:.3f}s\n\n'
+                              .format(**totals))
+            report_file.write(steps_table.get_string() + '\n\n')
+            report_file.write('Top commands:\n' + commands_table.get_string() + '\n')
+        with open(os.path.join(report_dir, 'profile.json'), 'w') as report_file:
+            json.dump({'scenario': self.scenario, 'totals': totals, 'steps': self.steps, 'commands': self.commands},
+                      report_file, indent=2)
+
+        self.logger.info('Profile of {}: sleeping {sleeping:.1f}s, waiting {waiting:.1f}s, working {working:.1f}s'
+                         .format(self.scenario, **totals))
+        return totals
@@ -0,0 +1,152 @@
+"""
+JavaScript snippets executed in the browser by page objects.
+"""
+
+# Async script: arguments are xpath, appear (bool), timeout in ms and the callback of execute_async_script.
+# Calls back as soon as presence of the xpath matches appear (checked on every DOM mutation):
+# with the found element when it has to appear, with true when it has to disappear.
+# Calls back with null (false) when timeout is over.
+WAIT_FOR_XPATH = '''
+var xpath = arguments[0], appear = arguments[1], timeout = arguments[2], done = arguments[arguments.length - 1];
+function matches() {
+    var node = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    return appear ? node : node === null;
+}
+var found = matches();
+if (found) {
+    done(found);
+    return;
+}
+var finished = false, timer = null;
+var observer = new MutationObserver(function () {
+    var found = finished ? null : matches();
+    if (found) {
+        finish(found);
+    }
+});
+function finish(result) {
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(result);
+}
+observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+timer = setTimeout(function () { finish(matches()); }, timeout);
+'''
+
+# Async script: arguments are quiet period in ms, timeout in ms and the callback of execute_async_script.
+# Installs tracker of pending fetch/XHR requests and DOM mutations once per document, then calls back
+# when the document is loaded, no requests are pending and DOM is not changed for the quiet period,
+# or when timeout is over. Requests sent before the tracker is installed are not counted.
+WAIT_FOR_SETTLED = '''
+var quiet = arguments[0], timeout = arguments[1], done = arguments[arguments.length - 1];
+if (!window.__settleTracker) {
+    var tracker = window.__settleTracker = {pending: 0, lastMutation: Date.now()};
+    var originalFetch = window.fetch;
+    if (originalFetch) {
+        window.fetch = function () {
+            tracker.pending++;
+            return originalFetch.apply(this, arguments).finally(function () { tracker.pending--; });
+        };
+    }
+    var originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        tracker.pending++;
+        this.addEventListener('loadend', function () { tracker.pending--; });
+        try {
+            return originalSend.apply(this, arguments);
+        } catch (e) {
+            tracker.pending--;
+            throw e;
+        }
+    };
+    new MutationObserver(function () { tracker.lastMutation = Date.now(); })
+        .observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+var start = Date.now();
+(function check() {
+    var tracker = window.__settleTracker, now = Date.now();
+    var settled = document.readyState === 'complete' && tracker.pending <= 0 && now - tracker.lastMutation >= quiet;
+    if (settled || now - start >= timeout) {
+        done({settled: settled, pending: tracker.pending, readyState: document.readyState, waited: now - start});
+    } else {
+        setTimeout(check, Math.min(50, quiet));
+    }
+})();
+'''
+
+# Sync script: arguments are xpath, kind of value (text, attribute, visible, rect) and attribute name.
+# Returns the value for every element matching the xpath, in document order.
+READ_ALL = '''
+var xpath = arguments[0], kind = arguments[1], name = arguments[2];
+var snapshot = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var values = [];
+for (var i = 0; i < snapshot.snapshotLength; i++) {
+    var node = snapshot.snapshotItem(i);
+    var element = node.nodeType === Node.ELEMENT_NODE;
+    if (kind === 'text') {
+        values.push((element && node.innerText !== undefined ? node.innerText : node.textContent).trim());
+    } else if (kind === 'attribute') {
+        values.push(element ? node.getAttribute(name) : null);
+    } else if (kind === 'visible') {
+        values.push(element && !!(node.offsetWidth || node.offsetHeight || node.getClientRects().length)
+                    && window.getComputedStyle(node).visibility !== 'hidden');
+    } else if (kind === 'rect') {
+        var rect = element ? node.getBoundingClientRect() : {left: 0, top: 0, width: 0, height: 0};
+        values.push({x: rect.left + window.pageXOffset, y: rect.top + window.pageYOffset,
+                     width: rect.width, height: rect.height});
+    }
+}
+return values;
+'''
+
+# Async script: clears local and session storage, Cache Storage, IndexedDB and service workers of the current origin.
+# Calls back with true when everything is cleared, errors of single storages are ignored.
+CLEAR_STORAGE = '''
+var done = arguments[arguments.length - 1];
+var tasks = [];
+function ignore() {}
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+try {
+    if (window.caches && caches.keys) {
+        tasks.push(caches.keys().then(function (keys) {
+            return Promise.all(keys.map(function (key) { return caches.delete(key); }));
+        }));
+    }
+    if (window.indexedDB && indexedDB.databases) {
+        tasks.push(indexedDB.databases().then(function (databases) {
+            databases.forEach(function (database) { indexedDB.deleteDatabase(database.name); });
+        }));
+    }
+    if (navigator.serviceWorker && navigator.serviceWorker.getRegistrations) {
+        tasks.push(navigator.serviceWorker.getRegistrations().then(function (registrations) {
+            return Promise.all(registrations.map(function (registration) { return registration.unregister(); }));
+        }));
+    }
+} catch (e) {}
+Promise.all(tasks.map(function (task) { return task.catch(ignore); })).then(function () { done(true); });
+'''
+
+# Sync script: Navigation Timing and Resource Timing entries of the current document, times in ms
+# relative to timeOrigin (epoch ms). Navigation is null for documents without navigation entry (about:blank).
+PAGE_TIMINGS = '''
+function pick(entry, keys) {
+    var result = {};
+    keys.forEach(function (key) { result[key] = entry[key]; });
+    return result;
+}
+var common = ['name', 'startTime', 'duration', 'domainLookupStart', 'domainLookupEnd', 'connectStart',
+              'connectEnd', 'secureConnectionStart', 'requestStart', 'responseStart', 'responseEnd',
+              'transferSize', 'encodedBodySize'];
+var navigation = performance.getEntriesByType('navigation')[0];
+return {
+    url: location.href,
+    title: document.title,
+    timeOrigin: performance.timeOrigin || performance.timing.navigationStart,
+    navigation: navigation ? pick(navigation, common.concat(['type', 'domContentLoadedEventEnd', 'loadEventEnd'])) : null,
+    resources: performance.getEntriesByType('resource').map(function (entry) {
+        return pick(entry, common.concat(['initiatorType']));
+    })
+};
+'''
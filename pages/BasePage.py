@@ -1,16 +1,26 @@
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as ec
 from selenium.common.exceptions import *
 
 from core.decorators import log_exception
 from core.base_class import BaseClass
+from core import profiler
+from core import scripts
 from utilities.config import Config
 from utilities.common import *
 
+import time
+
 
 class BasePage(BaseClass):
     """
     Base page representation.
     Class for UI actions related to this page
     """
+    # seconds of one MutationObserver script run and polling intervals of waitForObject
+    OBSERVE_CHUNK = 20
+    POLL_MIN = 0.05
+    POLL_MAX = 1
 
     # def select_user(self, userName):
     #     TRANSFORMATION_MAP = {
@@ -37,10 +47,12 @@ class BasePage(BaseClass):
     # waitForObject(<locator>, state='appear')
     # waitForObject(<locator>, state='disappear')
     @log_exception('Failed check web element state with xpath: {}')
-    def waitForObject(self, xpath, state=None, wait=120, lazy_wait=1):
+    def waitForObject(self, xpath, state=None, wait=120, lazy_wait=0):
         """
         if state=='disappear', wait until existing object disappeared
         if state=='appear', wait until non-existing object appeared
+        Browser notifies about the change by MutationObserver, so there is no polling delay.
+        Falls back to polling with growing interval if the script can't run (page is reloaded, alert etc.).
         :param xpath: str - web element xpath
         :param state: str - switcher for method
         :param wait: int - maximum wait time
@@ -49,14 +61,50 @@ class BasePage(BaseClass):
         if state is None or (state.lower() != 'appear' and state.lower() != 'disappear'):
             raise InvalidArgumentException("you should specify 'state' param for method waitForObject every time")
 
-        self.logger.info('Checking web element {} with xpath: {}'.format(state, xpath))
-        time_out = 0
-        while self.checkObjExists(xpath=xpath) if state.lower() == 'disappear' \
-                else not self.checkObjExists(xpath=xpath) if state.lower() == 'appear' else False:
-
-            self.sleep(2)
-            time_out += 2
-            if time_out > wait:
-                raise TimeoutException
-        self.logger.info('Checked web element {} with xpath: {}'.format(state, xpath))
-        self.sleep(lazy_wait)
+        self.logger.debug('Checking web element %s with xpath: %s', state, xpath)
+        appear = state.lower() == 'appear'
+        deadline = time.time() + wait
+        with profiler.waiting():
+            if not self._observe_object(xpath, appear, deadline) and not self._poll_object(xpath, appear, deadline):
+                raise TimeoutException('Web element with xpath {} did not {} in {} seconds'.format(xpath, state, wait))
+        if not appear:
+            self.cached_elements.invalidate()
+        self.logger.info('Checked web element %s with xpath: %s', state, xpath)
+        if lazy_wait:
+            self.sleep(lazy_wait)
+
+    def _observe_object(self, xpath, appear, deadline):
+        """
+        Wait for the object in the browser by MutationObserver.
+        Script runs in chunks shorter than default script timeout of the drivers (30 seconds).
+        :return: boolean - True if the object is in expected state, False if it has to be polled
+        """
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                found = self.browser.execute_async_script(scripts.WAIT_FOR_XPATH, xpath, appear,
+                                                          int(min(remaining, self.OBSERVE_CHUNK) * 1000))
+                if found:
+                    # appeared element is returned by the script, next action on it needs no lookup
+                    if isinstance(found, WebElement):
+                        self.cached_elements.put(xpath, ec.presence_of_element_located, found)
+                    return True
+            except WebDriverException as e:
+                self.logger.debug('Cannot observe web element with xpath: %s, polling it. %s', xpath, e.msg)
+                return False
+
+    def _poll_object(self, xpath, appear, deadline):
+        """
+        Poll the object presence, interval grows from POLL_MIN to POLL_MAX.
+        :return: boolean - True if the object is in expected state before the deadline
+        """
+        interval = self.POLL_MIN
+        while self.checkObjExists(xpath=xpath) != appear:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.POLL_MAX)
+        return True
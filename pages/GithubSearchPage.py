@@ -21,3 +21,7 @@ class GithubSearchPage(BasePage):
     def open_repo_with_text(self, text):
         self.waitForObject(github_search_page.repository_title_with_text(text), state='appear')
         self.click(github_search_page.repository_title_with_text(text))
+
+    def get_repository_titles(self):
+        self.waitForObject(github_search_page.repository_title, state='appear')
+        return self.get_texts(github_search_page.repository_title)
@@ -2,13 +2,27 @@ from random import randint
 from pathlib import Path
 from prettytable import PrettyTable
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from functools import partial
-from subprocess import call
-from glob import glob
 
+from behave.tag_expression import TagExpression
 
+from utilities.collector import collect_units, units_from_split_files, write_split_files, save_manifest, \
+    load_manifest, filter_units, FeatureParseError, SPLITTER_VERSION
+from utilities.case_cache import CaseCache
+from utilities.durations import DurationStore
+from utilities.scheduler import Scheduler
+from utilities.shared_store import SharedStore
+from utilities.timing_db import TimingDB
+from utilities import behave_worker
+from utilities import orchestrator
+
+import threading
+import tempfile
 import logging
+import shutil
 import click
+import queue
 import time
 import os
 import sys
@@ -43,165 +57,329 @@ def main(context):
 @click.option('--features-dir', '-fd', "features_dir", default='./', type=str, show_default=True, help='source features directory')
 @click.option('--result-file-path', '-res', "result_dir", default='./', type=str, show_default=True, help='direcotry you want to save splitted files result')
 @click.option('--sequence-tag', '-st', 'sequence_tag', type=str, default='@serial', show_default=True, help='tag to find and join dependent cases behind')
-@click.option('--tags', '-t', 'tags', type=str, help='tags of needed cases [don`t works for behave tags expressions]')
-def split(features_dir, result_dir, sequence_tag, tags):
+@click.option('--tags', '-t', 'tags', type=str, multiple=True, help='behave tags expression of needed cases, several options are joined with AND')
+@click.option('--outline-rows', 'outline_rows', type=int, default=1, show_default=True,
+              help='examples rows of Scenario Outline in one file (0 - whole outline in one file)')
+@click.option('--cache-file', 'cache_file', default='.parallel_cache.json', show_default=True,
+              help='cache of feature files cut into cases, only changed files are parsed again')
+@click.option('--no-cache', 'no_cache', is_flag=True, help='parse all feature files and do not update the cache')
+def split(features_dir, result_dir, sequence_tag, tags, outline_rows, cache_file, no_cache):
 
     Path(result_dir).mkdir(parents=True, exist_ok=True)
     # if there are old .feature files in 'parallel' directory, purge them
     for f in os.listdir(result_dir):
         os.remove(os.path.join(result_dir, f))
 
-    required_tags = tags.replace(' ', '').split(',')
-    if not sequence_tag.startswith('@'):
-        sequence_tag = '@' + sequence_tag
-
-    logger.info('Splitting normal cases...')
-
-    index = 1
-    serial_index = 0
-    seq_tag_mapping = {}
-    sequence_cases = {}
-
-    feature_files_paths = []
-    feature_files = [os.path.normpath(feature_path) for feature_path in glob(features_dir + '/*.feature')]
-
-    for feature_file in feature_files:
-
-        # check the file. if it has none of the tags we need, skip it
-        with open(feature_file, 'r') as f:
-            feature_content = f.read().strip()
-        if not any(tag in feature_content for tag in required_tags):
-            continue
-
-        # get filename part by format like 'par_<feature_name>_<num>
-        filename_head = f"{result_dir}/par_{os.path.splitext(os.path.basename(feature_file))[0]}_"
-        # blocks header - case1 - case2 - ... are split by '\n\n' in standard feature file format
-        feature_blocks = feature_content.split('\n\n')
-
-        feature_header = feature_blocks[0] + '\n\n\n'
-        # tags are in the first line of a header / case
-        feature_tags = set(feature_header.split('\n')[0].strip().split())
-        # exclude cases that are commented out
-        all_cases = [case.strip() for case in feature_blocks[1:]]
-        feature_cases = ['    ' + case for case in all_cases if not case.startswith('#')]
-
-        # get parallel testcases and store @serial testcases for later
-        for case in feature_cases:
-            case_tags = set(case.split('\n')[0].strip().split())
-
-            # matched tag in feature tags                    # matched tag in case tags
-            if any((feature_tags.intersection(required_tags), case_tags.intersection(required_tags))):
-                if sequence_tag in case:
-                    # join @serial files by tag intersection (CASES FROM DIFFERENT SERIES MUST NOT INTERSECT)
-                    num_tags = sorted([tag for tag in case_tags if all(ch.isnumeric() for ch in tag[1:])])
-                    is_different_sequence = True
-                    for tag in num_tags:
-                        if tag in seq_tag_mapping:
-                            is_different_sequence = False
-                            break
-                    serial_index += is_different_sequence
-                    seq_tag_mapping.update(zip(num_tags, [serial_index] * len(num_tags)))
-                    idx_to_assign = seq_tag_mapping[num_tags[0]]
-
-                    try:
-                        sequence_cases[idx_to_assign]['cases'].append(case)
-                    except KeyError:
-                        sequence_cases[idx_to_assign] = {'header': feature_header, 'cases': [case]}
-                else:
-                    with open(f"{filename_head}{index}.feature", 'w', encoding='utf-8') as result:
-                        result.write(feature_header)
-                        result.write(case + '\n')
-                    index += 1
-        logger.info(feature_file + '\tis splitted')
-
-        logger.info('Splitting sequence cases...')
-
-        for case_info in sequence_cases.values():
-            with open(f"{filename_head}sequence_{index}.feature", 'w', encoding='utf-8') as result:
-                result.write(case_info['header'])
-                result.write('\n\n'.join(case_info['cases']))
-            index += 1
+    logger.info('Splitting cases...')
+    try:
+        files = write_split_files(features_dir, result_dir, sequence_tag, outline_rows, _tag_expression(tags),
+                                  _case_cache(cache_file, no_cache))
+    except FeatureParseError as e:
+        raise click.ClickException(str(e))
+    logger.info(f'{len(files)} files are written to {result_dir}')
 
     logger.info('............SPLITTING COMPLETED............\n')
 
 
-@main.command(short_help='run already splitted cases (runs cases from files with "par_" prefix only)')
+@main.command(short_help='collect cases from original feature files into a schedule manifest (no split needed)')
+@click.option('--features-dir', '-fd', "features_dir", default='./', type=str, show_default=True, help='source features directory')
+@click.option('--sequence-tag', '-st', 'sequence_tag', type=str, default='@serial', show_default=True, help='tag to find and join dependent cases behind')
+@click.option('--outline-rows', 'outline_rows', type=int, default=1, show_default=True,
+              help='examples rows of Scenario Outline in one unit (0 - whole outline in one unit)')
+@click.option('--tags', '-t', 'tags', type=str, multiple=True, help='behave tags expression of needed cases, several options are joined with AND')
+@click.option('--manifest', '-m', 'manifest', type=str, default='parallel_manifest.json', show_default=True, help='manifest file to write')
+@click.option('--cache-file', 'cache_file', default='.parallel_cache.json', show_default=True,
+              help='cache of feature files cut into cases, only changed files are parsed again')
+@click.option('--no-cache', 'no_cache', is_flag=True, help='parse all feature files and do not update the cache')
+def collect(features_dir, sequence_tag, outline_rows, tags, manifest, cache_file, no_cache):
+    try:
+        units = collect_units(features_dir, sequence_tag, outline_rows, _tag_expression(tags),
+                              _case_cache(cache_file, no_cache))
+    except FeatureParseError as e:
+        raise click.ClickException(str(e))
+    save_manifest(manifest, units)
+    logger.info(f"{_scenarios_count(units)} scenarios in {len(units)} units from {features_dir} are saved to {manifest}")
+
+
+@main.command(short_help='run splitted cases (files with "par_" prefix), cases from original feature files or from manifest')
 @click.option('--feature-dir', '-fd', 'feature_dir', type=str, default='./', show_default=True, help='feature root directory')
-@click.option('--processes', '-p', type=int, default=5, show_default=True, help='number of processes')
+@click.option('--from-features', is_flag=True, help='run cases right from original feature files of --feature-dir by "path:line" locations, without split')
+@click.option('--sequence-tag', '-st', 'sequence_tag', type=str, default='@serial', show_default=True, help='tag to find and join dependent cases behind (with --from-features)')
+@click.option('--outline-rows', 'outline_rows', type=int, default=1, show_default=True,
+              help='examples rows of Scenario Outline in one unit (with --from-features)')
+@click.option('--manifest', '-m', 'manifest', type=str, help='run cases from manifest created by "collect" command')
+@click.option('--save-manifest', 'save_manifest_path', type=str, help='save collected cases to manifest file before the run')
+@click.option('--cache-file', 'cache_file', default='.parallel_cache.json', show_default=True,
+              help='cache of feature files cut into cases, only changed files are parsed again')
+@click.option('--no-cache', 'no_cache', is_flag=True, help='parse all feature files and do not update the cache')
+@click.option('--processes', '-p', type=int, default=5, show_default=True, help='number of processes (threads with --mode thread)')
 @click.option('--no-skipped', '-k', is_flag=True, help='do not include skipped cases in report')  # same help?
 @click.option('--enable-multithread', is_flag=True, help='include option "-D run_mode="Multithreaded" to behave args')
 @click.option('--no-capture', is_flag=True, help='do not include skipped cases in report')  # same help?
-@click.option('--tags', '-t', help='specify behave tags to run')
+@click.option('--tags', '-t', multiple=True, help='specify behave tags to run (several options are joined with AND, as in behave)')
 @click.option('--format', '-f', 'formatter', help='formatter')
 @click.option('--venv', help='virtual environment')
+@click.option('--mode', type=click.Choice(['subprocess', 'inprocess', 'thread']), default='subprocess', show_default=True,
+              help='subprocess - start behave for every feature, inprocess - run features inside warm pool workers, '
+                   'thread - run features in threads of the runner process')
+@click.option('--durations-file', 'durations_file', default='.parallel_durations.json', show_default=True,
+              help='file with durations of previous runs, used to start the longest features first')
+@click.option('--timing-db', 'timing_db', default='.parallel_timings.sqlite', show_default=True,
+              help='SQLite database with timings of features, scenarios and steps of every run (see "stats" command)')
+@click.option('--no-timing-db', 'no_timing_db', is_flag=True, help='do not record timings of this run')
+@click.option('--history-runs', 'history_runs', type=int, default=5, show_default=True,
+              help='last runs of the timing database used to estimate scenario durations')
 @click.option('--outfile', '-o', help='outfile')
 @click.option('--define', '-D', multiple=True, help='''Define user-specific data for the config.userdata dictionary.
                                                     Example: -D foo=bar to store it in config.userdata["foo"].''')
-def run(feature_dir, processes, no_skipped, enable_multithread, no_capture, tags, formatter, venv, outfile, define):
-    features = glob(feature_dir + '/par*.feature')
-    features = [os.path.normpath(feature) for feature in features]
+def run(feature_dir, from_features, sequence_tag, outline_rows, manifest, save_manifest_path, cache_file, no_cache,
+        processes, no_skipped, enable_multithread, no_capture, tags, formatter, venv, mode, durations_file,
+        timing_db, no_timing_db, history_runs, outfile, define):
+    # scenarios filtered out by tags are not scheduled at all, so no empty behave runs
+    tag_expression = _tag_expression(tags)
+    try:
+        if manifest:
+            units = filter_units(load_manifest(manifest), tag_expression)
+        elif from_features:
+            units = collect_units(feature_dir, sequence_tag, outline_rows, tag_expression,
+                                  _case_cache(cache_file, no_cache))
+        else:
+            units = units_from_split_files(feature_dir, tag_expression)
+    except FeatureParseError as e:
+        # behave would fail on the file, so the run fails before it starts
+        raise click.ClickException(str(e))
+
+    if save_manifest_path:
+        save_manifest(save_manifest_path, units)
+
+    # units with the longest chain go first, so the slow ones don't end up alone at the tail of the run
+    durations = DurationStore(durations_file)
+    timings = None if no_timing_db else TimingDB(timing_db)
+    if timings:
+        durations.merge(timings.scenario_durations(timings.last_runs(history_runs)))
+    scheduler = Scheduler(units, lambda unit: durations.estimate(unit.scenarios))
 
     params = []
     if no_skipped:
         params.append("--no-skipped")
     if no_capture:
         params.append("--no-capture")
-    if tags:
-        params.append(f"--tags={tags}")
+    for tag in tags:
+        params.append(f"--tags={tag}")
     if outfile:
-        params.append(f"-o {outfile}")
+        params.extend(["-o", outfile])
     if formatter:
-        params.append(f"-f {formatter}")
-    if define:
-        params.append(f"-D {' -D '.join(define)}")
+        params.extend(["-f", formatter])
+    for item in define:
+        params.extend(["-D", item])
     if enable_multithread:
-        params.append("-D behave_run_mode=Multithreaded")
-
-    args = {
-        "params": ' '.join(params),
-        "venv": venv or False
-    }
+        params.extend(["-D", "behave_run_mode=Multithreaded"])
+        # project_db shared by all behave processes, they find it by environment variable
+        store_dir = tempfile.mkdtemp(prefix='parallel_runner_')
+        os.environ[SharedStore.ENV_VAR] = os.path.join(store_dir, 'project_db.sqlite')
+        store = SharedStore(os.environ[SharedStore.ENV_VAR])
 
     processes_time = {}
 
-    run_feature = partial(_run_feature, args=args)
+    if mode in ('inprocess', 'thread') and venv:
+        logger.warning(f"--venv is ignored in {mode} mode, behave runs in the current interpreter")
+    if mode == 'inprocess':
+        run_unit = _run_unit_in_process
+        pool_class = Pool
+        pool_args = {"initializer": behave_worker.init_worker, "initargs": (params,)}
+    elif mode == 'thread':
+        # WebDriver calls wait for the browser most of the time, so threads of one interpreter are enough
+        behave_worker.init_worker(params, threaded=True)
+        _keep_runner_console()
+        run_unit = _run_unit_in_thread
+        pool_class = ThreadPool
+        pool_args = {}
+
+    if timings:
+        # hooks of every behave process write their timings into the same database
+        run_id = timings.start_run(processes, mode)
+        os.environ[TimingDB.ENV_VAR] = os.path.abspath(timing_db)
+        os.environ[TimingDB.RUN_VAR] = str(run_id)
+
+    logger.info(f"Found {_scenarios_count(units)} scenarios in {len(units)} units to run")
+    logger.info(f"Expected work: {scheduler.total_work:.0f}s, longest chain: {scheduler.critical_path:.0f}s")
+
+    def unit_finished(pid, duration_time, unit, status):
+        scheduler.done(unit)
+
+        print(f"{unit.name}: {status}!!")
+        durations.record(unit.scenarios, duration_time)
+        if timings:
+            timings.add_unit(run_id, unit.name, pid, time.time() - duration_time, duration_time, status)
+        if pid in processes_time.keys():
+            processes_time[pid] += duration_time
+        else:
+            processes_time[pid] = duration_time
+
+    completed = True
+    if mode == 'subprocess':
+        # behave processes are started by the runner itself and handled as soon as each of them exits
+        completed = orchestrator.run(scheduler, processes, orchestrator.behave_command(params, venv), unit_finished)
+    else:
+        _run_in_pool(scheduler, pool_class(processes, **pool_args), processes, run_unit, unit_finished)
+
+    durations.save()
+    if timings:
+        timings.finish_run(run_id)
+        timings.close()
+        logger.info(f"Timings of run {run_id} are saved to {timing_db}, see \"parallel_runner.py stats\"")
 
-    logger.info(f"Found {len(features)} features")
-    with Pool(processes) as pool:
-        for pid, duration_time, feature, status in pool.map(run_feature, features):
-            print(f"{feature}: {status}!!")
-            if pid in processes_time.keys():
-                processes_time[pid] += duration_time
-            else:
-                processes_time[pid] = duration_time
+    if enable_multithread:
+        logger.info(f"project_db after the run: {store.to_dict()}")
+        store.close()
+        shutil.rmtree(store_dir, ignore_errors=True)
 
     # LOG THREAD TIMES
     times_table = PrettyTable(['PID', 'Time (s)'])
     for pid in processes_time.keys():
-        times_table.add_row([pid, processes_time[pid]])
+        times_table.add_row([pid, round(processes_time[pid], 2)])
 
     with open("processes_time_log.log", "w") as time_log:
         time_log.write(times_table.get_string())
 
     logger.info("\n\nTime per process: \n" + times_table.get_string())
 
+    if not completed:
+        raise click.Abort()
+
+
+@main.command(short_help='show the slowest scenarios and steps, regressions, network savings and worker utilization from the timing database')
+@click.option('--timing-db', 'timing_db', default='.parallel_timings.sqlite', show_default=True, help='timing database written by "run"')
+@click.option('--runs', '-n', 'runs', type=int, default=5, show_default=True, help='last runs to analyze')
+@click.option('--top', type=int, default=10, show_default=True, help='rows in the slowest scenarios and steps tables')
+@click.option('--threshold', type=float, default=1.5, show_default=True,
+              help='scenario is a regression when the last run took longer than the average of previous runs times threshold')
+def stats(timing_db, runs, top, threshold):
+    if not os.path.exists(timing_db):
+        raise click.ClickException(f"{timing_db} not found, it is written by \"run\" command")
+
+    timings = TimingDB(timing_db)
+    run_ids = timings.last_runs(runs + 1)
+    if not run_ids:
+        raise click.ClickException(f"There are no finished runs in {timing_db}")
+    last_run, history = run_ids[0], run_ids[1:]
+    run_ids = run_ids[:runs]
+
+    table = PrettyTable(['Feature', 'Scenario', 'Avg (s)', 'Max (s)', 'Runs', 'Failed'])
+    for feature, name, average, maximum, count, failed in timings.slowest_scenarios(run_ids, top):
+        table.add_row([feature, name, round(average, 2), round(maximum, 2), count, failed])
+    logger.info(f"\n\nSlowest scenarios of the last {len(run_ids)} runs: \n" + table.get_string())
+
+    table = PrettyTable(['Step', 'Avg (s)', 'Max (s)', 'Count', 'Total (s)'])
+    for name, average, maximum, count, total in timings.slowest_steps(run_ids, top):
+        table.add_row([name, round(average, 2), round(maximum, 2), count, round(total, 2)])
+    logger.info(f"\n\nSlowest steps of the last {len(run_ids)} runs: \n" + table.get_string())
+
+    table = PrettyTable(['Feature', 'Scenario', 'Last run (s)', 'Previous avg (s)', 'Ratio'])
+    for feature, name, duration, average, ratio in timings.regressions(last_run, history, threshold):
+        table.add_row([feature, name, round(duration, 2), round(average, 2), round(ratio, 2)])
+    logger.info(f"\n\nRegressions of run {last_run} against {len(history)} previous runs: \n" + table.get_string())
+
+    table = PrettyTable(['Launch profile', 'Browsers', 'Startup avg (s)', 'Startup max (s)'])
+    for profile, count, average, maximum in timings.browser_startups(run_ids):
+        table.add_row([profile or '-', count, round(average, 2), round(maximum, 2)])
+    logger.info(f"\n\nBrowser startup of the last {len(run_ids)} runs: \n" + table.get_string())
+
+    table = PrettyTable(['Network policies', 'Scenarios', 'Blocked requests', 'Saved (KB)', 'Unknown size'])
+    for policies, count, blocked, saved_bytes, unknown_size in timings.network_savings(run_ids):
+        table.add_row([policies, count, blocked, round(saved_bytes / 1024, 1), unknown_size])
+    logger.info(f"\n\nNetwork savings of the last {len(run_ids)} runs: \n" + table.get_string())
+
+    wall_time, workers = timings.utilization(last_run)
+    table = PrettyTable(['Worker', 'Units', 'Busy (s)', 'Utilization (%)', 'Browser startup avg (s)'])
+    for worker, count, busy, startup in workers:
+        # run finished in no time or worker without measured units
+        utilization = round(100 * busy / wall_time, 1) if busy is not None and wall_time else '-'
+        table.add_row([worker, count, round(busy, 2) if busy is not None else '-', utilization,
+                       round(startup, 2) if startup is not None else '-'])
+    logger.info(f"\n\nWorkers of run {last_run} ({wall_time:.0f}s): \n" + table.get_string())
+
+    timings.close()
+
+
+def _tag_expression(tags):
+    """
+    Compile behave tags expression once for all scenarios, None if there are no tags.
+    """
+    return TagExpression(tags) if tags else None
+
+
+def _case_cache(cache_file, no_cache):
+    return None if no_cache else CaseCache(cache_file, SPLITTER_VERSION)
+
+
+def _scenarios_count(units):
+    return sum(len(unit.scenarios) for unit in units)
+
+
+def _keep_runner_console():
+    """
+    Behave runs of "--mode thread" replace logging of this process by log.ini, with console showing only summary.
+    Runner messages keep the current console handlers of their own.
+    """
+    for handler in logging.getLogger().handlers:
+        logger.addHandler(handler)
+    logger.propagate = False
+
+
+def _run_in_pool(scheduler, pool, processes, run_unit, on_result):
+    results = queue.Queue()
+    running = 0
+    with pool:
+        while not scheduler.finished():
+            # every free worker takes the ready unit with the longest chain behind it and free resources
+            while running < processes:
+                unit = scheduler.next_unit()
+                if unit is None:
+                    break
+                pool.apply_async(run_unit, (unit,), callback=results.put,
+                                 error_callback=partial(_unit_error, results, unit))
+                running += 1
+
+            result = results.get()
+            running -= 1
+            on_result(*result)
+
+        # workers exit by themselves (not terminated), so their finalizers quit pooled browsers
+        pool.close()
+        pool.join()
+
+
+def _unit_error(results, unit, error):
+    logger.error(f"{unit.name} is not run: {error!r}")
+    results.put((str(os.getpid()), 0, unit, 'failed'))
+
+
+def _run_unit_in_process(unit):
+    logger.info(f"behave {' '.join(unit.locations)} (in process)")
+    os.environ[TimingDB.WORKER_VAR] = str(os.getpid())
 
-def _run_feature(feature, args):
-    cmd = f"behave {args['params']} {feature}"
+    logger.info("pool pid: " + str(os.getpid()))
 
-    if args["venv"]:
-        cmd = f"{args['venv']}/{cmd}"
+    start_time = time.time()
+    r = behave_worker.run_feature(*unit.locations)
+    duration_time = time.time() - start_time
 
-    logger.info(cmd.replace('  ', ' '))
+    status = 'ok' if r == 0 else 'failed'
+    return str(os.getpid()), duration_time, unit, status
 
-    logger.info("pool pid: " + str(os.getpid()))
+
+def _run_unit_in_thread(unit):
+    # hooks get the worker from behave userdata, environment is shared by all threads
+    worker = f"{os.getpid()}-{threading.current_thread().name}"
+    logger.info(f"behave {' '.join(unit.locations)} (in thread {worker})")
 
     start_time = time.time()
-    r = call(cmd, shell=True)
-    duration_time = int(time.time() - start_time)
+    r = behave_worker.run_feature(*unit.locations, thread=worker)
+    duration_time = time.time() - start_time
 
     status = 'ok' if r == 0 else 'failed'
-    return str(os.getpid()), duration_time, feature, status
+    return worker, duration_time, unit, status
 
 
 if __name__ == '__main__':
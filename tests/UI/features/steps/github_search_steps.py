@@ -8,6 +8,13 @@ def see_repositories(context, repo_count):
     assert_that(count, is_(greater_than(repo_count)))
 
 
+@step('I see repositories "{repo_names}" in search results')
+def see_repositories_in_results(context, repo_names):
+    titles = context.github_search_page.get_repository_titles()
+    for repo_name in repo_names.split(','):
+        assert_that(titles, has_item(contains_string(repo_name.strip())))
+
+
 @step('I navigate into repo with name "{repo_name}"')
 def see_repositories(context, repo_name):
     context.github_search_page.open_repo_with_text(repo_name)
@@ -0,0 +1,44 @@
+from behave import *
+from hamcrest import *
+
+from core import page_timings
+
+
+def _page_metric(context, metric, seconds):
+    # waits no longer than the budget, a page that hasn't reached the metric by then is over budget anyway
+    page = page_timings.wait_for_metric(context.browser, metric, seconds)
+    assert_that(page[metric], is_not(none()),
+                'Page {} has not reached {} within {}s'.format(page['url'], metric, seconds))
+    return page
+
+
+@step('the page responds within {seconds:g} seconds')
+def page_responds_within(context, seconds):
+    page = _page_metric(context, 'ttfb', seconds)
+    assert_that(page['ttfb'], less_than_or_equal_to(seconds), 'Time to first byte of {}'.format(page['url']))
+
+
+@step('the page is interactive within {seconds:g} seconds')
+def page_interactive_within(context, seconds):
+    page = _page_metric(context, 'dom_content_loaded', seconds)
+    assert_that(page['dom_content_loaded'], less_than_or_equal_to(seconds),
+                'DOMContentLoaded of {}'.format(page['url']))
+
+
+@step('the page loads within {seconds:g} seconds')
+def page_loads_within(context, seconds):
+    page = _page_metric(context, 'load', seconds)
+    assert_that(page['load'], less_than_or_equal_to(seconds), 'Load time of {}'.format(page['url']))
+
+
+@step('the page makes at most {count:d} requests')
+def page_requests_at_most(context, count):
+    page = page_timings.current_page(context.browser)
+    assert_that(page['requests'], less_than_or_equal_to(count), 'Requests of {}'.format(page['url']))
+
+
+@step('the page transfers at most {size:g} KB')
+def page_transfers_at_most(context, size):
+    page = page_timings.current_page(context.browser)
+    assert_that(page['transfer_size'] / 1024, less_than_or_equal_to(size),
+                'Transferred KB of {}'.format(page['url']))
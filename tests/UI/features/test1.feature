@@ -28,3 +28,14 @@ Feature: Test1 feature
         And I see repositories associated with user and its count greater than "1"
         When I navigate into repo with name "Crypto11"
         And I see that repo "Crypto11" belongs to "Derr22" author
+
+    @4444
+    Scenario: Test1 - 4
+        Given I open Github URL in browser
+        When I search "user:dazmagar" text
+        Then I see repositories "test-apache" in search results
+
+    @5555 @performance
+    Scenario: Test1 - 5
+        Given I open Github URL in browser
+        Then the page loads within 10 seconds
@@ -0,0 +1,57 @@
+from multiprocessing.pool import ThreadPool
+from glob import glob
+
+import shutil
+import os
+
+import pytest
+
+from utilities import behave_worker
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FEATURE = '''Feature: {name}
+
+  Scenario: {name} scenario
+    Given I wait a bit
+'''
+
+STEPS = '''import time
+from behave import given
+
+
+@given('I wait a bit')
+def wait_a_bit(context):
+    time.sleep(0.2)
+'''
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    features = tmp_path / 'features'
+    (features / 'steps').mkdir(parents=True)
+    (features / 'steps' / 'steps.py').write_text(STEPS)
+    for name in ('first', 'second'):
+        (features / '{}.feature'.format(name)).write_text(FEATURE.format(name=name))
+    # Config of thread runs reads config.ini of the current directory
+    shutil.copy(os.path.join(ROOT, 'config.example.ini'), str(tmp_path / 'config.ini'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_thread_runs_write_own_outfiles(project):
+    outfile = str(project / 'out.txt')
+    behave_worker.init_worker(['-f', 'plain', '-o', outfile], threaded=True)
+
+    paths = ['features/first.feature', 'features/second.feature']
+    with ThreadPool(2) as pool:
+        codes = pool.starmap(lambda path, thread: behave_worker.run_feature(path, thread=thread),
+                             [(path, 'thread-{}'.format(index)) for index, path in enumerate(paths)])
+
+    assert codes == [0, 0]
+    reports = sorted(glob(str(project / 'out.*.txt')))
+    assert len(reports) == 2
+    contents = [open(report).read() for report in reports]
+    assert sorted('Feature: first' in content for content in contents) == [False, True]
+    assert all('I wait a bit ... passed' in content for content in contents)
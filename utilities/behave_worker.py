@@ -0,0 +1,191 @@
+"""
+In-process behave execution for parallel_runner.py.
+Every pool worker parses behave configuration and loads hooks and step definitions once,
+then runs many features in the same interpreter instead of starting "behave" for each of them.
+With "--mode thread" workers are threads of one process: every behave run gets its own context,
+Config overrides (see utilities.config.ThreadConfig) and browsers, output capture is disabled
+because behave captures stdout and logging of the whole process.
+"""
+from allure_behave.formatter import AllureFormatter
+from allure_commons import plugin_manager
+from behave.configuration import Configuration, ConfigError
+from behave.formatter._registry import select_formatter_class
+from behave.formatter.base import StreamOpener
+from behave.parser import ParserError
+from behave.runner import Runner
+from behave.runner_util import print_undefined_step_snippets, InvalidFileLocationError, InvalidFilenameError, \
+    FileNotFoundError, PathManager
+
+import itertools
+import threading
+import copy
+import os
+
+
+# userdata key with the worker thread name, present only in behave runs of "--mode thread"
+THREAD_KEY = 'parallel_thread'
+# userdata key present in behave runs of warm workers ("--mode inprocess" and "thread"), which run more features later
+WARM_KEY = 'parallel_warm_worker'
+
+
+class LockedPathManager(PathManager):
+    """
+    PathManager of behave changing sys.path under a process-wide lock, so parallel runs don't lose each other's paths.
+    """
+    lock = threading.RLock()
+
+    def __enter__(self):
+        with LockedPathManager.lock:
+            PathManager.__enter__(self)
+
+    def __exit__(self, *exc_info):
+        with LockedPathManager.lock:
+            PathManager.__exit__(self, *exc_info)
+
+    def add(self, path):
+        with LockedPathManager.lock:
+            PathManager.add(self, path)
+
+
+class WarmRunner(Runner):
+    """
+    Behave runner which loads environment hooks and step definitions only once per process.
+    Behave step registry is global, so loading the same steps again would raise AmbiguousStep.
+    """
+    _hooks = {}
+    _steps_dirs = set()
+    _lock = threading.RLock()
+
+    def __init__(self, config):
+        super(WarmRunner, self).__init__(config)
+        self.path_manager = LockedPathManager()
+
+    def load_hooks(self, filename=None):
+        with WarmRunner._lock:
+            if self.base_dir not in WarmRunner._hooks:
+                super(WarmRunner, self).load_hooks(filename)
+                WarmRunner._hooks[self.base_dir] = self.hooks
+        self.hooks = dict(WarmRunner._hooks[self.base_dir])
+
+    def load_step_definitions(self, extra_step_paths=None):
+        with WarmRunner._lock:
+            if self.base_dir not in WarmRunner._steps_dirs:
+                super(WarmRunner, self).load_step_definitions(extra_step_paths)
+                WarmRunner._steps_dirs.add(self.base_dir)
+
+
+# configuration of the current worker process, see init_worker
+_config = None
+# numbers of behave runs of the process, outfiles of every run get its number
+_runs = itertools.count(1)
+
+
+def init_worker(command_args, threaded=False):
+    """
+    Pool initializer. Parse behave command line once for the worker process.
+    :param command_args: list of str - behave arguments without feature paths
+    :param threaded: boolean - behave runs in threads of this process, disables output capture
+    """
+    global _config
+
+    config = Configuration(command_args)
+    # same defaults as behave.__main__.run_behave applies
+    if not config.format:
+        config.format = [config.default_format]
+    elif config.format and 'format' in config.defaults:
+        if len(config.format) == len(config.defaults['format']):
+            config.format.append(config.default_format)
+    if len(config.outputs) > len(config.format):
+        raise ConfigError('More outfiles ({}) than formatters ({})'.format(len(config.outputs), len(config.format)))
+    if threaded:
+        # capture replaces sys.stdout and adds a handler to the root logger, shared by all threads
+        config.stdout_capture = False
+        config.stderr_capture = False
+        config.log_capture = False
+
+    _config = config
+
+
+def _feature_config(paths):
+    """
+    Copy of the worker configuration for one behave run.
+    Reporters and userdata keep state, so every run gets its own.
+    """
+    config = copy.copy(_config)
+    config.paths = [os.path.normpath(path) for path in paths]
+    config.userdata = copy.copy(_config.userdata)
+    config.userdata[WARM_KEY] = 'true'
+    config.reporters = [reporter.__class__(config) for reporter in _config.reporters]
+    config.outputs = _run_outputs(_config, next(_runs))
+    return config
+
+
+def _run_outputs(config, run):
+    """
+    Stream openers of one behave run. Formatters close their streams at the end of the run,
+    so runs never share them: outfile "report.txt" becomes "report.<pid>-<run>.txt" for every run
+    (runs of one process or of parallel threads would truncate or close the same file).
+    Allure writes result files into its output directory, all runs keep the same one.
+    """
+    outputs = []
+    for index, opener in enumerate(config.outputs):
+        if opener.name is None:
+            # stdout, never closed by formatters
+            outputs.append(opener)
+            continue
+        formatter_class = select_formatter_class(config.format[index]) if index < len(config.format) else None
+        if formatter_class is not None and issubclass(formatter_class, AllureFormatter):
+            outputs.append(StreamOpener(opener.name))
+            continue
+        root, extension = os.path.splitext(opener.name)
+        outputs.append(StreamOpener('{}.{}-{}{}'.format(root, os.getpid(), run, extension)))
+    return outputs
+
+
+def run_feature(*paths, thread=None):
+    """
+    Run behave for given feature paths in the current process.
+    Mirrors behave.__main__.run_behave, but keeps already loaded steps.
+    :param thread: str - name of the worker thread, for behave runs of "--mode thread"
+    :return: int - behave exit code
+    """
+    if _config is None:
+        raise RuntimeError('init_worker must be called before run_feature')
+
+    config = _feature_config(paths)
+    if thread is None:
+        return _run(config)
+    # Config reads config.ini of the project, it is imported only by behave runs
+    from utilities.config import Config
+
+    config.userdata[THREAD_KEY] = thread
+    # before_all applies userdata to Config, only for this thread
+    with Config.isolated():
+        return _run(config)
+
+
+def _run(config):
+    # allure formatter registers its plugins for every run and never removes them, they would report twice
+    plugins = set(plugin_manager.get_plugins())
+    runner = WarmRunner(config)
+    failed = True
+    try:
+        failed = runner.run()
+    except ParserError as e:
+        print(u"ParserError: %s" % e)
+    except ConfigError as e:
+        print(u"ConfigError: %s" % e)
+    except FileNotFoundError as e:
+        print(u"FileNotFoundError: %s" % e)
+    except InvalidFileLocationError as e:
+        print(u"InvalidFileLocationError: %s" % e)
+    except InvalidFilenameError as e:
+        print(u"InvalidFilenameError: %s" % e)
+    finally:
+        for plugin in set(plugin_manager.get_plugins()) - plugins:
+            plugin_manager.unregister(plugin)
+
+    if config.show_snippets and runner.undefined_steps:
+        print_undefined_step_snippets(runner.undefined_steps, colored=config.color)
+
+    return 1 if failed else 0
@@ -0,0 +1,110 @@
+"""
+Benchmark of BaseClass.submit_search with fixed lazy_wait sleeps against waiting for the page to settle.
+Serves resources/fixtures/settle_page.html from a local server with slow endpoint and runs the search
+in local Chrome both ways, then prints time per search and how often the results were complete after it.
+Run from the project root: python -m utilities.benchmark_settle --runs 5 --headless
+"""
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from prettytable import PrettyTable
+from functools import partial
+from selenium.webdriver.common.keys import Keys
+
+from core.base_class import BaseClass
+from utilities.config import Config
+
+import threading
+import platform
+import click
+import json
+import time
+import copy
+import os
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'fixtures')
+
+SEARCH_FIELD = "//input[@id='search']"
+RESULTS_DONE = "//ul[@id='results'][@data-done='true']"
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    Static fixtures and /slow?ms=<delay> endpoint answering with JSON after the delay.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/slow':
+            return super(FixtureHandler, self).do_GET()
+
+        query = parse_qs(url.query)
+        time.sleep(int(query.get('ms', ['0'])[0]) / 1000)
+        body = json.dumps({'items': ['{} result {}'.format(query.get('q', [''])[0], i) for i in range(5)]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _sleeping_search(page, xpath, text, lazy_wait=2):
+    """
+    BaseClass.submit_search as it was before waiting for the page to settle.
+    """
+    input_field = page._get_element(xpath)
+    if platform.system() == 'Darwin':
+        input_field.clear()
+    else:
+        input_field.send_keys(Keys.CONTROL, 'a', Keys.DELETE)
+    page.sleep(lazy_wait / 2)
+    input_field.send_keys(text)
+    page.sleep(lazy_wait / 2)
+    page._get_element(xpath).send_keys(Keys.ENTER)
+    page.sleep(lazy_wait)
+
+
+def _settled_search(page, xpath, text, lazy_wait=2):
+    page.submit_search(xpath, text, lazy_wait=lazy_wait)
+
+
+@click.command()
+@click.option('--runs', type=int, default=5, show_default=True, help='searches of every kind')
+@click.option('--delay', type=int, default=800, show_default=True, help='server delay of search results (ms)')
+@click.option('--headless', is_flag=True, help='run Chrome headless')
+def main(runs, delay, headless):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(FixtureHandler, directory=FIXTURES_DIR))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/settle_page.html?delay={}'.format(server.server_address[1], delay)
+
+    options = copy.deepcopy(Config.CHROME_OPTIONS)
+    if headless:
+        options.add_argument('--headless')
+    browser = Config.browser_types['Chrome'](chrome_options=options)
+
+    table = PrettyTable(['Search', 'Avg (s)', 'Max (s)', 'Results complete after search'])
+    try:
+        page = BaseClass(browser)
+        for name, search in (('fixed sleeps', _sleeping_search), ('settled', _settled_search)):
+            durations = []
+            complete = 0
+            for run in range(runs):
+                page.open(url)
+                start = time.time()
+                search(page, SEARCH_FIELD, 'query {}'.format(run))
+                durations.append(time.time() - start)
+                complete += len(browser.find_elements_by_xpath(RESULTS_DONE))
+            table.add_row([name, round(sum(durations) / runs, 2), round(max(durations), 2),
+                           '{}/{}'.format(complete, runs)])
+    finally:
+        browser.quit()
+        server.shutdown()
+
+    print(table.get_string())
+
+
+if __name__ == '__main__':
+    main()
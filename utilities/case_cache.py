@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import json
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+class CaseCache(object):
+    """
+    Cache of feature files already cut into cases.
+    Entry of a feature file is reused only when the file content, the options of cutting
+    (tags expression, sequence tag, outline rows) and the splitter version are the same.
+    Stored as JSON file between runs.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, splitter_version):
+        """
+        :param path: str - path to the JSON cache file
+        :param splitter_version: int - version of cutting algorithm, entries of other versions are dropped
+        """
+        self.path = path
+        self.splitter_version = splitter_version
+        self.entries = {}
+        self.reused = []
+        self.rebuilt = []
+
+        if not os.path.exists(path):
+            return
+
+        try:
+            with open(path, 'r') as cache_file:
+                content = json.load(cache_file)
+        except ValueError:
+            logger.warning('Cache file %s is broken, all features will be parsed again', path)
+            return
+
+        if content.get('version') == self.FORMAT_VERSION and content.get('splitter') == splitter_version:
+            self.entries = content.get('features', {})
+        else:
+            logger.info('Cache file {} is created by another splitter version, all features will be parsed again'
+                        .format(path))
+
+    @staticmethod
+    def key(content, *options):
+        """
+        Cache key of feature file content and cutting options.
+        :param content: bytes - feature file content
+        :param options: values that change the result of cutting
+        """
+        digest = hashlib.sha1(content)
+        digest.update(json.dumps([str(option) for option in options]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, feature_file, key):
+        """
+        :return: cached value or None
+        """
+        entry = self.entries.get(feature_file)
+        if entry and entry['key'] == key:
+            self.reused.append(feature_file)
+            return entry['value']
+        self.rebuilt.append(feature_file)
+        return None
+
+    def put(self, feature_file, key, value):
+        """
+        :param value: JSON serializable value
+        """
+        self.entries[feature_file] = {'key': key, 'value': value}
+
+    def save(self):
+        """
+        Write entries to the file, entries of deleted features are dropped.
+        File is replaced atomically, so parallel readers never see half written cache.
+        """
+        entries = {feature_file: entry for feature_file, entry in self.entries.items() if os.path.exists(feature_file)}
+
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as cache_file:
+            json.dump({'version': self.FORMAT_VERSION, 'splitter': self.splitter_version, 'features': entries},
+                      cache_file)
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        logger.info('Cases cache: %s features reused, %s rebuilt', len(self.reused), len(self.rebuilt))
+        for feature_file in self.rebuilt:
+            logger.info('Rebuilt: %s', feature_file)
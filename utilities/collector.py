@@ -0,0 +1,399 @@
+"""
+Collection of work units for parallel_runner.py.
+A work unit is one behave invocation: a list of feature locations ("path" or "path:line")
+and scenarios they run. Units are built from split files or right from the original
+feature files, and can be stored in a JSON manifest to reuse the same schedule later.
+"""
+from behave.parser import parse_file, ParserError
+from glob import glob
+
+import logging
+import json
+import os
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+# version of cutting feature files into cases, change it to invalidate CaseCache entries
+SPLITTER_VERSION = 2
+
+
+class WorkUnit(object):
+    """
+    Scenarios that are run by one behave process.
+    """
+
+    def __init__(self, name, locations, scenarios, tags=None, depends_on=None):
+        """
+        :param name: str - unit name for logs
+        :param locations: list of str - behave locations, "path" or "path:line"
+        :param scenarios: list of (feature name, scenario name, steps count)
+        :param tags: list of str - tags of all unit scenarios
+        :param depends_on: list of str - names of units that must finish before this one starts
+        """
+        self.name = name
+        self.locations = list(locations)
+        self.scenarios = [tuple(scenario) for scenario in scenarios]
+        self.tags = sorted(set(str(tag) for tag in tags or []))
+        self.depends_on = list(depends_on or [])
+
+    def __repr__(self):
+        return '<WorkUnit {}>'.format(self.name)
+
+    def to_dict(self):
+        return {'name': self.name, 'locations': self.locations,
+                'scenarios': [list(scenario) for scenario in self.scenarios], 'tags': self.tags,
+                'depends_on': self.depends_on}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['locations'], data['scenarios'], data.get('tags'), data.get('depends_on'))
+
+
+class FeatureParseError(ValueError):
+    """
+    Feature file behave can't parse. Such a file is never dropped from the schedule, behave would fail on it too.
+    """
+
+
+def _parse_feature(feature_path):
+    """
+    :return: behave.model.Feature, None if the file has no feature
+    :raises FeatureParseError: if behave can't parse the file
+    """
+    try:
+        return parse_file(feature_path)
+    except (ParserError, IOError) as e:
+        raise FeatureParseError('Cannot parse {}: {}'.format(feature_path, e))
+
+
+def _steps_count(scenario):
+    return len(list(scenario.all_steps))
+
+
+def _first_line(element):
+    """
+    First line of a model element including its tags lines.
+    """
+    return min([tag.line for tag in element.tags] + [element.line])
+
+
+def _text(lines, start, end):
+    """
+    Lines from start to end (1-based, inclusive) without trailing empty lines.
+    """
+    return '\n'.join(lines[start - 1:end]).rstrip() + '\n'
+
+
+def _should_run(scenario, tag_expression):
+    """
+    Same decision as behave makes for --tags: scenario tags together with feature (and examples) tags.
+    """
+    return tag_expression is None or scenario.should_run_with_tags(tag_expression)
+
+
+def unit_from_file(feature_path, tag_expression=None):
+    """
+    Work unit running the whole feature file (used for already split files).
+    :param feature_path: str - path to .feature file
+    :param tag_expression: behave.tag_expression.TagExpression - keep only scenarios selected by it
+    :return: WorkUnit
+    :raises FeatureParseError: if behave can't parse the file
+    """
+    feature = _parse_feature(feature_path)
+    if feature is None:
+        return WorkUnit(feature_path, [feature_path], [])
+
+    scenarios = [scenario for scenario in feature.walk_scenarios() if _should_run(scenario, tag_expression)]
+    tags = set(feature.tags)
+    for scenario in scenarios:
+        tags.update(scenario.effective_tags)
+    return WorkUnit(feature_path, [feature_path],
+                    [(feature.name, scenario.name, _steps_count(scenario)) for scenario in scenarios], tags)
+
+
+def units_from_split_files(feature_dir, tag_expression=None):
+    """
+    Work units for files created by "split" command (files with "par_" prefix).
+    Files without scenarios selected by the tag expression are skipped.
+    :param feature_dir: str - directory with split files
+    :param tag_expression: behave.tag_expression.TagExpression
+    :return: list of WorkUnit
+    """
+    features = [os.path.normpath(feature) for feature in glob(feature_dir + '/par*.feature')]
+    units = [unit_from_file(feature, tag_expression) for feature in features]
+    return [unit for unit in units if unit.scenarios or tag_expression is None]
+
+
+def _rows_tags(scenarios):
+    return set(tag for scenario in scenarios for tag in scenario.effective_tags)
+
+
+def _case_unit(feature_file, feature, scenarios, tags):
+    locations = ['{}:{}'.format(feature_file, scenario.line) for scenario in scenarios]
+    name = locations[0] if len(locations) == 1 else '{} ({} rows)'.format(locations[0], len(locations))
+    return WorkUnit(name, locations,
+                    [(feature.name, scenario.name, _steps_count(scenario)) for scenario in scenarios], tags)
+
+
+def read_cases(feature_file, sequence_tag='@serial', outline_rows=1, tag_expression=None):
+    """
+    Parse feature file with behave parser and cut it into cases.
+    Every scenario is a case. Scenario Outline examples rows are separate cases
+    (grouped by outline_rows rows), unless the outline has the sequence tag.
+    :param feature_file: str - path to .feature file
+    :param sequence_tag: str - tag of dependent scenarios
+    :param outline_rows: int - number of examples rows in one case, 0 - whole outline is one case
+    :param tag_expression: behave.tag_expression.TagExpression - keep only scenarios (rows) selected by it
+    :return: tuple - (feature header text, list of (WorkUnit, case text)); (None, []) if file has no scenarios
+    :raises FeatureParseError: if behave can't parse the file, it is never cut into zero cases
+    """
+    feature = _parse_feature(feature_file)
+    if feature is None or not feature.scenarios:
+        return None, []
+
+    with open(feature_file, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    sequence_tag = sequence_tag.lstrip('@')
+    starts = [_first_line(scenario) for scenario in feature.scenarios] + [len(lines) + 1]
+    # feature tags, description and background
+    header = _text(lines, 1, starts[0] - 1) + '\n\n'
+
+    cases = []
+    for scenario, start, next_start in zip(feature.scenarios, starts, starts[1:]):
+        # rows of an outline are separate scenarios for behave, each has its own line
+        row_scenarios = [row for row in getattr(scenario, 'scenarios', [scenario]) if _should_run(row, tag_expression)]
+        if not row_scenarios:
+            continue
+        # rows of different Examples blocks have tags of their own block
+        tags = _rows_tags(row_scenarios)
+
+        examples = getattr(scenario, 'examples', [])
+        if not examples or outline_rows <= 0 or sequence_tag in tags:
+            cases.append((_case_unit(feature_file, feature, row_scenarios, tags), _text(lines, start, next_start - 1)))
+            continue
+
+        outline_text = _text(lines, start, _first_line(examples[0]) - 1)
+        rows_by_line = {row.line: row for row in row_scenarios}
+        for example in examples:
+            example_head = _text(lines, _first_line(example), example.table.line)
+            rows = [row.line for row in example.table.rows if row.line in rows_by_line]
+            for index in range(0, len(rows), outline_rows):
+                chunk = rows[index:index + outline_rows]
+                text = outline_text + '\n' + example_head + ''.join(_text(lines, line, line) for line in chunk)
+                chunk_scenarios = [rows_by_line[line] for line in chunk]
+                cases.append((_case_unit(feature_file, feature, chunk_scenarios, _rows_tags(chunk_scenarios)), text))
+
+    return header, cases
+
+
+class _UnionFind(object):
+    """
+    Disjoint sets of case indexes.
+    """
+
+    def __init__(self, size):
+        self.parents = list(range(size))
+
+    def find(self, item):
+        while self.parents[item] != item:
+            self.parents[item] = self.parents[self.parents[item]]
+            item = self.parents[item]
+        return item
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        # the earliest case stays the root, so groups keep the order of cases
+        self.parents[max(first, second)] = min(first, second)
+
+
+def _join_sequences(cases, sequence_tag):
+    """
+    Join cases with the sequence tag into sequences: cases sharing any numeric tag are in one sequence,
+    also when the link goes through other cases (@1 @2, @2 @3 and @3 are one sequence).
+    :param cases: list of (WorkUnit, case text, feature header)
+    :return: tuple - (independent cases, list of sequences as lists of cases in the written order)
+    """
+    sequence_tag = sequence_tag.lstrip('@')
+
+    independent = [case for case in cases if sequence_tag not in case[0].tags]
+    dependent = [case for case in cases if sequence_tag in case[0].tags]
+
+    groups = _UnionFind(len(dependent))
+    first_case_with_tag = {}
+    for index, (unit, _, _) in enumerate(dependent):
+        for tag in unit.tags:
+            if tag.isnumeric():
+                groups.union(first_case_with_tag.setdefault(tag, index), index)
+
+    sequences = {}
+    for index, case in enumerate(dependent):
+        sequences.setdefault(groups.find(index), []).append(case)
+
+    return independent, [sequences[root] for root in sorted(sequences)]
+
+
+def _cached_cases(cache, feature_file, sequence_tag, outline_rows, tag_expression):
+    """
+    Cases of the feature file from the cache, the file is parsed only when it or cutting options changed.
+    """
+    with open(feature_file, 'rb') as f:
+        key = cache.key(f.read(), sequence_tag, outline_rows, tag_expression)
+
+    cached = cache.get(feature_file, key)
+    if cached is not None:
+        return cached['header'], [(WorkUnit.from_dict(unit), text) for unit, text in cached['cases']]
+
+    header, cases = read_cases(feature_file, sequence_tag, outline_rows, tag_expression)
+    cache.put(feature_file, key, {'header': header, 'cases': [[unit.to_dict(), text] for unit, text in cases]})
+    return header, cases
+
+
+def read_all_cases(features_dir, sequence_tag='@serial', outline_rows=1, tag_expression=None, cache=None):
+    """
+    Cases of all feature files in the directory, sorted by file name.
+    :param features_dir: str - directory with .feature files
+    :param tag_expression: behave.tag_expression.TagExpression - if given, only selected scenarios are returned
+    :param cache: utilities.case_cache.CaseCache - reuse cases of unchanged feature files
+    :return: list of (WorkUnit, case text, feature header)
+    """
+    result = []
+    feature_files = sorted(os.path.normpath(feature_path) for feature_path in glob(features_dir + '/*.feature'))
+    for feature_file in feature_files:
+        if cache is None:
+            header, cases = read_cases(feature_file, sequence_tag, outline_rows, tag_expression)
+        else:
+            header, cases = _cached_cases(cache, feature_file, sequence_tag, outline_rows, tag_expression)
+        result.extend((unit, text, header) for unit, text in cases)
+
+    if cache is not None:
+        cache.save()
+        cache.report()
+    return result
+
+
+def collect_units(features_dir, sequence_tag='@serial', outline_rows=1, tag_expression=None, cache=None):
+    """
+    Work units right from original feature files, one unit per case.
+    Cases with the sequence tag are joined into sequences by their numeric tags. Every sequence is one unit
+    run by one behave process in the order the cases are written, so its cases share context, browser and login.
+    :param features_dir: str - directory with .feature files
+    :param sequence_tag: str - tag of dependent scenarios
+    :param outline_rows: int - number of Scenario Outline examples rows in one unit
+    :param tag_expression: behave.tag_expression.TagExpression - if given, only selected scenarios are collected
+    :param cache: utilities.case_cache.CaseCache - reuse cases of unchanged feature files
+    :return: list of WorkUnit
+    """
+    cases = read_all_cases(features_dir, sequence_tag, outline_rows, tag_expression, cache)
+    independent, sequences = _join_sequences(cases, sequence_tag)
+
+    units = [case[0] for case in independent]
+    for index, sequence in enumerate(sequences, 1):
+        chain = [case[0] for case in sequence]
+        units.append(WorkUnit('sequence_{}'.format(index),
+                              [location for unit in chain for location in unit.locations],
+                              [scenario for unit in chain for scenario in unit.scenarios],
+                              [tag for unit in chain for tag in unit.tags]))
+    return units
+
+
+def write_split_files(features_dir, result_dir, sequence_tag='@serial', outline_rows=1, tag_expression=None,
+                      cache=None):
+    """
+    Write every case to its own "par_<feature>_<n>.feature" file, sequences to "par_<feature>_sequence_<n>.feature".
+    :param features_dir: str - directory with .feature files
+    :param result_dir: str - directory for split files
+    :return: list of str - written files
+    """
+    cases = read_all_cases(features_dir, sequence_tag, outline_rows, tag_expression, cache)
+    independent, sequences = _join_sequences(cases, sequence_tag)
+
+    def feature_name(unit):
+        return os.path.splitext(os.path.basename(unit.locations[0].rsplit(':', 1)[0]))[0]
+
+    files = []
+    index = 1
+    for unit, text, header in independent:
+        files.append(os.path.join(result_dir, 'par_{}_{}.feature'.format(feature_name(unit), index)))
+        with open(files[-1], 'w', encoding='utf-8') as result:
+            result.write(header)
+            result.write(text)
+        index += 1
+
+    for sequence in sequences:
+        # sequence is run by one behave process, so it uses header of its first feature
+        files.append(os.path.join(result_dir, 'par_{}_sequence_{}.feature'.format(feature_name(sequence[0][0]), index)))
+        with open(files[-1], 'w', encoding='utf-8') as result:
+            result.write(sequence[0][2])
+            result.write('\n'.join(text for _, text, _ in sequence))
+        index += 1
+
+    return files
+
+
+def save_manifest(manifest_path, units):
+    """
+    Store work units as JSON manifest.
+    :param manifest_path: str
+    :param units: list of WorkUnit
+    """
+    with open(manifest_path, 'w') as manifest:
+        json.dump({'version': MANIFEST_VERSION, 'units': [unit.to_dict() for unit in units]}, manifest, indent=2)
+
+
+def load_manifest(manifest_path):
+    """
+    Read work units from JSON manifest created by save_manifest.
+    :param manifest_path: str
+    :return: list of WorkUnit
+    """
+    with open(manifest_path, 'r') as manifest:
+        content = json.load(manifest)
+
+    if content.get('version') != MANIFEST_VERSION:
+        raise ValueError('Unsupported manifest version {} in {}'.format(content.get('version'), manifest_path))
+
+    return [WorkUnit.from_dict(unit) for unit in content['units']]
+
+
+def filter_units(units, tag_expression):
+    """
+    Keep only scenarios of the units selected by the tags expression (e.g. units of a manifest run with --tags).
+    Units left without scenarios are dropped, so they don't start empty behave runs.
+    :param units: list of WorkUnit
+    :param tag_expression: behave.tag_expression.TagExpression
+    :return: list of WorkUnit
+    """
+    if tag_expression is None:
+        return units
+
+    features = {}
+
+    def scenario_at(location):
+        path, _, line = location.rpartition(':')
+        if not line.isdigit():
+            return None
+        if path not in features:
+            features[path] = _parse_feature(path)
+        feature = features[path]
+        if feature is None:
+            return None
+        return next((scenario for scenario in feature.walk_scenarios() if scenario.line == int(line)), None)
+
+    result = []
+    for unit in units:
+        if len(unit.locations) != len(unit.scenarios):
+            # whole feature files, behave itself skips scenarios filtered out by --tags
+            result.append(unit)
+            continue
+        kept = []
+        for location, scenario_info in zip(unit.locations, unit.scenarios):
+            scenario = scenario_at(location)
+            if scenario is None or _should_run(scenario, tag_expression):
+                kept.append((location, scenario_info))
+        if kept:
+            result.append(WorkUnit(unit.name, [location for location, _ in kept], [info for _, info in kept],
+                                   unit.tags, unit.depends_on))
+    return result
@@ -1,9 +1,68 @@
+from contextlib import contextmanager
+from functools import wraps
+
 import selenium.webdriver as webdriver
 import configparser
+import threading
 import os
 
 
-class Config(object):
+class ThreadConfig(type):
+    """
+    Metaclass of Config: inside Config.isolated() attributes set by a thread are seen only by this thread,
+    so behave runs of parallel_runner.py "--mode thread" apply their userdata without affecting each other.
+    """
+    _local = threading.local()
+
+    def __getattribute__(cls, name):
+        overrides = getattr(ThreadConfig._local, 'overrides', None)
+        if overrides is not None and name in overrides:
+            return overrides[name]
+        return type.__getattribute__(cls, name)
+
+    def __setattr__(cls, name, value):
+        overrides = getattr(ThreadConfig._local, 'overrides', None)
+        if overrides is not None:
+            overrides[name] = value
+        else:
+            type.__setattr__(cls, name, value)
+
+    @contextmanager
+    def isolated(cls, overrides=None):
+        """
+        Attributes set inside the block are seen only by the current thread and dropped at its end.
+        :param overrides: dict - attributes the thread starts with, e.g. from Config.overrides() of another thread
+        """
+        previous = getattr(ThreadConfig._local, 'overrides', None)
+        ThreadConfig._local.overrides = dict(overrides or {})
+        try:
+            yield
+        finally:
+            ThreadConfig._local.overrides = previous
+
+    def overrides(cls):
+        """
+        :return: dict - attributes set by the current thread, None outside of Config.isolated()
+        """
+        overrides = getattr(ThreadConfig._local, 'overrides', None)
+        return None if overrides is None else dict(overrides)
+
+    def bound(cls, func):
+        """
+        Function running with attributes of the current thread, for helper threads of a behave run.
+        """
+        overrides = cls.overrides()
+        if overrides is None:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with cls.isolated(overrides):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Config(object, metaclass=ThreadConfig):
     """
     Config class for storing values from config.ini and browser types.
     """
@@ -22,7 +81,7 @@ class Config(object):
     CHROME_OPTIONS.add_argument('--ignore-ssl-errors')
 
     CAPABILITIES = webdriver.DesiredCapabilities.CHROME
-    CAPABILITIES['goog:loggingPrefs'] = {'performance': 'ALL'}
+    CAPABILITIES['goog:loggingPrefs'] = {'performance': 'ALL', 'browser': 'ALL'}
 
     # end # browser configs only for local runs
 
@@ -31,15 +90,26 @@ class Config(object):
 
     HIGHLIGHT = config.getboolean('SELENIUM', 'Highlight')
     REUSE = config.getboolean('SELENIUM', 'Reuse')
+    PROFILE = config.getboolean('SELENIUM', 'Profile', fallback=False)
+    RESET_ON_REUSE = config.getboolean('SELENIUM', 'ResetOnReuse', fallback=False)
+    BROWSER_POOL = config.getboolean('SELENIUM', 'BrowserPool', fallback=False)
+    POOL_MAX_USES = config.getint('SELENIUM', 'PoolMaxUses', fallback=20)
+    BROWSER_PIPELINE = config.getboolean('SELENIUM', 'BrowserPipeline', fallback=False)
+    PIPELINE_SESSIONS = config.getint('SELENIUM', 'PipelineSessions', fallback=2)
+    PAGE_TIMINGS = config.getboolean('SELENIUM', 'PageTimings', fallback=False)
+    FAILURE_DOM = config.getboolean('SELENIUM', 'FailureDom', fallback=False)
+    FAILURE_CONSOLE = config.getboolean('SELENIUM', 'FailureConsole', fallback=False)
 
     BROWSERTYPE = config.get('BROWSER', 'BrowserType')
     PLATFORM = config.get('BROWSER', 'Platform')
     BROWSERNAME = config.get('BROWSER', 'BrowserName')
     VERSION = config.get('BROWSER', 'Version')
+    LAUNCH_PROFILE = config.get('BROWSER', 'LaunchProfile', fallback='default')
+    CHROMEDRIVER = config.get('BROWSER', 'ChromeDriver', fallback='chromedriver')
 
     # application
     APP_URL = config.get('APPLICATION', 'APP_URL')
-    # ENV = config.get('APPLICATION', 'ENV')
+    ENV = config.get('APPLICATION', 'ENV', fallback='test')
     # APP_URL = config.get('APPLICATION', 'APP_URL').replace("ENV", ENV)
     # POPUP_URL = config.get('APPLICATION', 'POPUP_URL')
     PROJECT_DB = config.get('APPLICATION', 'PROJECT_DB')
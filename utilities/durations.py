@@ -0,0 +1,115 @@
+import logging
+import json
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+class DurationStore(object):
+    """
+    Durations of features and scenarios from previous runs.
+    Stored as JSON file between runs and used to start the longest work first.
+    Scenarios that never ran get an estimate from scenarios of the same feature
+    or from the average step time of all known scenarios.
+    """
+    # weight of the last measurement in the stored duration
+    SMOOTHING = 0.5
+    # seconds per step when there is no history at all
+    DEFAULT_STEP_TIME = 5.0
+
+    def __init__(self, path):
+        """
+        :param path: str - path to the JSON file with durations history
+        """
+        self.path = path
+        self.features = {}
+        self.scenarios = {}
+        self._run_features = {}
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as durations_file:
+                    content = json.load(durations_file)
+                self.features = content.get('features', {})
+                self.scenarios = content.get('scenarios', {})
+            except (ValueError, AttributeError):
+                logger.warning('Durations file %s is broken, starting from scratch', path)
+
+    @staticmethod
+    def scenario_key(feature_name, scenario_name):
+        return '{}::{}'.format(feature_name, scenario_name)
+
+    def _step_time(self, feature_name):
+        """
+        Average time of one step: from the same feature if it ran before, else from all known scenarios.
+        """
+        feature = self.features.get(feature_name)
+        if feature and feature['steps']:
+            return feature['duration'] / feature['steps']
+
+        total_duration = sum(scenario['duration'] for scenario in self.scenarios.values())
+        total_steps = sum(scenario['steps'] for scenario in self.scenarios.values())
+        if total_steps:
+            return total_duration / total_steps
+
+        return self.DEFAULT_STEP_TIME
+
+    def estimate(self, scenarios):
+        """
+        Expected duration of running the given scenarios in one behave process.
+        :param scenarios: list of (feature name, scenario name, steps count)
+        :return: float - seconds
+        """
+        total = 0.0
+        for feature_name, scenario_name, steps in scenarios:
+            known = self.scenarios.get(self.scenario_key(feature_name, scenario_name))
+            if known:
+                total += known['duration']
+            else:
+                total += self._step_time(feature_name) * max(steps, 1)
+        return total or self._step_time(None)
+
+    def merge(self, scenarios):
+        """
+        Replace estimates with scenario durations measured by behave hooks (see utilities.timing_db).
+        Measured time of a scenario doesn't include the share of behave startup, so it is more precise.
+        :param scenarios: dict - {scenario key: {'duration': seconds, 'steps': steps count}}
+        """
+        self.scenarios.update(scenarios)
+
+    def record(self, scenarios, duration):
+        """
+        Store measured duration of the given scenarios.
+        Duration is shared between scenarios proportionally to their steps count.
+        :param scenarios: list of (feature name, scenario name, steps count)
+        :param duration: float - seconds
+        """
+        total_steps = sum(max(steps, 1) for _, _, steps in scenarios)
+        for feature_name, scenario_name, steps in scenarios:
+            measured = duration * max(steps, 1) / total_steps
+            scenario_duration = measured
+            key = self.scenario_key(feature_name, scenario_name)
+            known = self.scenarios.get(key)
+            if known:
+                scenario_duration = self.SMOOTHING * measured + (1 - self.SMOOTHING) * known['duration']
+            self.scenarios[key] = {'duration': round(scenario_duration, 3), 'steps': steps}
+
+            # features keep time of this run only
+            feature = self._run_features.setdefault(feature_name, {'duration': 0.0, 'steps': 0})
+            feature['duration'] += measured
+            feature['steps'] += max(steps, 1)
+
+    def save(self):
+        """
+        Merge features measured in this run into history and write it to the file.
+        """
+        for feature_name, feature in self._run_features.items():
+            self.features[feature_name] = {'duration': round(feature['duration'], 3), 'steps': feature['steps']}
+        self._run_features = {}
+
+        if not self.path:
+            return
+
+        with open(self.path, 'w') as durations_file:
+            json.dump({'features': self.features, 'scenarios': self.scenarios}, durations_file, indent=2)
@@ -1,27 +1,165 @@
+from collections import OrderedDict
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import util
 import logging.config
+import threading
+import atexit
+import queue
 import os
 
 from utilities.config import Config
 
 
+SCENARIO_LOG = 'scenario_log.txt'
+
+
+class ScenarioQueueHandler(QueueHandler):
+    """
+    Puts records into the queue as they are, stamped with the log folder of the current scenario.
+    Records don't leave the process, so messages are formatted by the listener thread, not by the caller.
+    """
+
+    def prepare(self, record):
+        record.scenario_dir = getattr(Logger.local, 'scenario_dir', None)
+        return record
+
+
+class ScenarioFileHandler(logging.Handler):
+    """
+    Writes every record of a scenario into <scenario log folder>/scenario_log.txt.
+    """
+    # files kept open at once, scenarios of one process rarely interleave
+    OPEN_FILES = 8
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.files = OrderedDict()
+        # logs of previous runs are replaced, logs of scenarios with the same name in this run are kept together
+        self.started = set()
+
+    def _file(self, scenario_dir):
+        log_file = self.files.pop(scenario_dir, None)
+        if log_file is None:
+            log_file = open(os.path.join(scenario_dir, SCENARIO_LOG), 'a' if scenario_dir in self.started else 'w',
+                            encoding='utf-8')
+            self.started.add(scenario_dir)
+            if len(self.files) >= self.OPEN_FILES:
+                self.files.popitem(last=False)[1].close()
+        self.files[scenario_dir] = log_file
+        return log_file
+
+    def emit(self, record):
+        if record.scenario_dir is None:
+            return
+        try:
+            log_file = self._file(record.scenario_dir)
+            log_file.write(self.format(record) + '\n')
+            log_file.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for log_file in self.files.values():
+            log_file.close()
+        self.files.clear()
+        logging.Handler.close(self)
+
+
+class SummaryFilter(logging.Filter):
+    """
+    Passes warnings, errors and records logged with extra={'summary': True}.
+    """
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or getattr(record, 'summary', False)
+
+
 class Logger(object):
+    # log folder of the scenario running in the thread, see start_scenario
+    local = threading.local()
+    listener = None
+    lock = threading.Lock()
+    _registered = False
 
     @staticmethod
-    def configure_logging():
+    def configure_logging(summary=True, keep_running=False):
         """
         Perform logging configuration from file named log.ini in root folder.
+        Handlers of log.ini are moved behind a queue: loggers only put records into it, one listener thread
+        formats and writes them, also into the log file of the current scenario.
+        :param summary: boolean - console shows only warnings and records logged with extra={'summary': True}
+        :param keep_running: boolean - keep logging configured by another behave run of the process as is
         """
-        if not os.path.exists(Config.LOG_DIR):
-            os.mkdir(Config.LOG_DIR)
-            
+        with Logger.lock:
+            if keep_running and Logger.listener is not None:
+                return
+            Logger._configure(summary)
+
+    @staticmethod
+    def _configure(summary):
+        os.makedirs(Config.LOG_DIR, exist_ok=True)
+
+        # every behave run of "--mode inprocess" worker configures logging again
+        Logger.stop()
+        # module level loggers created before (or by the previous run) keep working
         logging.config.fileConfig('log.ini', defaults={'logdir': Config.LOG_DIR,
-                                                       'datetime': str(datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f'))})
+                                                       'datetime': str(datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f'))},
+                                  disable_existing_loggers=False)
+
+        root = logging.getLogger()
+        handlers = root.handlers[:]
+        scenario_handler = ScenarioFileHandler()
+        for handler in handlers:
+            root.removeHandler(handler)
+            if handler.name == 'ConsoleHandler' and summary:
+                handler.addFilter(SummaryFilter())
+            if handler.name == 'FileHandler':
+                scenario_handler.setFormatter(handler.formatter)
+
+        queue_handler = ScenarioQueueHandler(queue.SimpleQueue())
+        root.addHandler(queue_handler)
+        Logger.listener = QueueListener(queue_handler.queue, scenario_handler, *handlers, respect_handler_level=True)
+        Logger.listener.start()
+
+        if not Logger._registered:
+            Logger._registered = True
+            # pool workers of multiprocessing exit without atexit handlers, but run finalizers
+            util.Finalize(None, Logger.stop, exitpriority=1)
+            atexit.register(Logger.stop)
+
+    @staticmethod
+    def stop():
+        """
+        Write all queued records and close handlers. Safe to call many times.
+        """
+        listener, Logger.listener = Logger.listener, None
+        if listener is None:
+            return
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            if isinstance(handler, ScenarioQueueHandler):
+                root.removeHandler(handler)
 
     @staticmethod
     def create_test_folder(test_id):
         test_id = test_id.replace(' ', '_')
         report_dir = '{}/{}'.format(Config.LOG_DIR, test_id)
 
-        if not os.path.exists(report_dir):
-            os.mkdir(report_dir)
+        # scenarios with the same name may start in parallel threads
+        os.makedirs(report_dir, exist_ok=True)
+        return report_dir
+
+    @staticmethod
+    def start_scenario(test_id):
+        """
+        Create log folder of the scenario and route records of the current thread into its scenario_log.txt.
+        """
+        Logger.local.scenario_dir = Logger.create_test_folder(test_id)
+
+    @staticmethod
+    def end_scenario():
+        Logger.local.scenario_dir = None
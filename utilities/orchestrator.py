@@ -0,0 +1,124 @@
+"""
+Asyncio orchestration of behave processes for "parallel_runner.py run --mode subprocess".
+The runner process starts behave for every unit directly (no shell, no pool of Python processes waiting for them)
+and handles the result of every unit as soon as its process exits, so the scheduler starts the next ready unit
+right away. A slot is just a running child process, so one small coordinator keeps hundreds of behave processes
+(e.g. each driving a remote grid session) running at once.
+On cancellation (Ctrl+C) running behave processes are terminated, and killed if they don't exit in time.
+"""
+from utilities.timing_db import TimingDB
+
+import asyncio
+import logging
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# seconds a terminated behave process gets to quit its browsers and write reports before it is killed
+STOP_TIMEOUT = 10
+
+
+def behave_command(params, venv=None):
+    """
+    :param params: list of str - behave arguments shared by all units
+    :param venv: str - folder with behave executable of the virtual environment, None for behave from PATH
+    :return: list of str - argv of behave without feature locations
+    """
+    return [f"{venv}/behave" if venv else 'behave'] + list(params)
+
+
+async def _stop(process):
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning('behave process %s is killed, it did not stop in %ss', process.pid, STOP_TIMEOUT)
+        process.kill()
+        await process.wait()
+    except ProcessLookupError:
+        pass
+
+
+async def run_unit(unit, command, worker):
+    """
+    Run behave process for the unit and wait until it exits.
+    :param unit: utilities.collector.Unit
+    :param command: list of str - see behave_command
+    :param worker: str - worker id recorded into the timing database by hooks of the process
+    :return: (worker, duration, unit, status 'ok' or 'failed')
+    """
+    args = command + list(unit.locations)
+    logger.info(' '.join(args))
+
+    # behave process gets it from its environment, so its hooks know the worker
+    env = dict(os.environ, **{TimingDB.WORKER_VAR: worker})
+    start_time = time.time()
+    process = await asyncio.create_subprocess_exec(*args, env=env)
+    try:
+        code = await process.wait()
+    except asyncio.CancelledError:
+        await _stop(process)
+        raise
+    duration_time = time.time() - start_time
+
+    status = 'ok' if code == 0 else 'failed'
+    return worker, duration_time, unit, status
+
+
+async def run_units(scheduler, processes, command, on_result):
+    """
+    Run units of the scheduler with at most `processes` behave processes at once.
+    :param scheduler: utilities.scheduler.Scheduler
+    :param processes: int - concurrent behave processes
+    :param command: list of str - see behave_command
+    :param on_result: function(worker, duration, unit, status) - called as soon as a unit finishes
+    """
+    # worker ids are slots, so utilization of "stats" shows how busy every slot was
+    free_slots = [f"{os.getpid()}-{slot}" for slot in range(processes, 0, -1)]
+    running = {}
+    try:
+        while not scheduler.finished():
+            # every free slot takes the ready unit with the longest chain behind it and free resources
+            while free_slots:
+                unit = scheduler.next_unit()
+                if unit is None:
+                    break
+                worker = free_slots.pop()
+                running[asyncio.ensure_future(run_unit(unit, command, worker))] = (worker, unit)
+
+            if not running:
+                raise RuntimeError(f"{scheduler.__class__.__name__} has no ready units while nothing runs")
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                worker, unit = running.pop(task)
+                free_slots.append(worker)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.error('%s is not run: %r', unit.name, e)
+                    result = worker, 0, unit, 'failed'
+                on_result(*result)
+    finally:
+        # cancelled or failed run doesn't leave behave processes behind
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+def run(scheduler, processes, command, on_result):
+    """
+    Blocking run_units.
+    :return: bool - False if the run was interrupted, results of finished units are already handled
+    """
+    try:
+        asyncio.run(run_units(scheduler, processes, command, on_result))
+    except KeyboardInterrupt:
+        logger.warning("Run is interrupted, running behave processes are stopped")
+        return False
+    return True
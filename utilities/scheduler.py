@@ -0,0 +1,183 @@
+"""
+Critical path scheduling of work units for parallel_runner.py.
+Units and their dependencies (depends_on of manifest units) form a DAG.
+Every unit gets a rank - the longest expected time from its start to the end of its chain,
+and free workers always take the ready unit with the highest rank. Long chains start first
+and keep a worker busy till the end, independent units fill the remaining workers.
+
+Units tagged with @lock:<resource> (or @lock:<resource>:read / @lock:<resource>:write)
+never run at the same time as other units writing the same resource. Only the runner
+starts behave processes, so it is the lock manager for all of them.
+"""
+import heapq
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_TAG = 'lock'
+READ = 'read'
+WRITE = 'write'
+
+
+def unit_locks(unit):
+    """
+    Resources locked by the unit from its @lock tags.
+    :param unit: utilities.collector.WorkUnit
+    :return: dict - {resource: READ or WRITE}, WRITE wins if the resource is tagged both ways
+    """
+    locks = {}
+    for tag in unit.tags:
+        parts = tag.split(':')
+        if parts[0] != LOCK_TAG or len(parts) < 2 or not parts[1]:
+            continue
+        mode = parts[2] if len(parts) > 2 else WRITE
+        if mode not in (READ, WRITE):
+            logger.warning('Unknown lock mode in tag @%s of %s, locking for write', tag, unit.name)
+            mode = WRITE
+        if locks.get(parts[1]) != WRITE:
+            locks[parts[1]] = mode
+    return locks
+
+
+class ResourceLocks(object):
+    """
+    Readers-writer locks of named resources held by running units.
+    """
+
+    def __init__(self):
+        self.readers = {}
+        self.writers = set()
+
+    def available(self, locks):
+        for resource, mode in locks.items():
+            if resource in self.writers:
+                return False
+            if mode == WRITE and self.readers.get(resource):
+                return False
+        return True
+
+    def acquire(self, locks):
+        for resource, mode in locks.items():
+            if mode == WRITE:
+                self.writers.add(resource)
+            else:
+                self.readers[resource] = self.readers.get(resource, 0) + 1
+
+    def release(self, locks):
+        for resource, mode in locks.items():
+            if mode == WRITE:
+                self.writers.discard(resource)
+            else:
+                self.readers[resource] -= 1
+
+
+class Scheduler(object):
+    """
+    Hands out ready units by rank, skipping units whose resources are locked by running ones.
+    Not thread-safe, used from the runner main thread only.
+    """
+
+    def __init__(self, units, estimate):
+        """
+        :param units: list of utilities.collector.WorkUnit
+        :param estimate: function - expected duration of a unit in seconds
+        """
+        self.units = {unit.name: unit for unit in units}
+        self.locks = {unit.name: unit_locks(unit) for unit in units}
+        self.resources = ResourceLocks()
+        self.durations = {unit.name: estimate(unit) for unit in units}
+        self.successors = {unit.name: [] for unit in units}
+        self.waiting_for = {}
+
+        for unit in units:
+            # dependencies out of this run (filtered by tags) are already satisfied
+            predecessors = [name for name in unit.depends_on if name in self.units]
+            self.waiting_for[unit.name] = len(predecessors)
+            for name in predecessors:
+                self.successors[name].append(unit.name)
+
+        self.ranks = {}
+        for name in self.units:
+            self._rank(name)
+
+        self._ready = []
+        self._order = 0
+        for name, count in self.waiting_for.items():
+            if count == 0:
+                self._push(name)
+        self.remaining = len(self.units)
+
+    def _rank(self, name):
+        """
+        Own duration plus the longest rank of successors.
+        Depth-first walk without recursion, chains can be long.
+        """
+        path = set()
+        stack = [(name, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if current in self.ranks:
+                continue
+            if expanded:
+                path.discard(current)
+                self.ranks[current] = self.durations[current] + max(
+                    [self.ranks[successor] for successor in self.successors[current]] or [0])
+                continue
+            if current in path:
+                raise ValueError('Units dependencies have a cycle through {}'.format(current))
+            path.add(current)
+            stack.append((current, True))
+            stack.extend((successor, False) for successor in self.successors[current] if successor not in self.ranks)
+        return self.ranks[name]
+
+    def _push(self, name):
+        # heapq is a min-heap, order keeps units with equal rank in the collected order
+        heapq.heappush(self._ready, (-self.ranks[name], self._order, name))
+        self._order += 1
+
+    @property
+    def critical_path(self):
+        """
+        Expected duration of the longest chain, the run can't be shorter than that.
+        """
+        return max(self.ranks.values() or [0])
+
+    @property
+    def total_work(self):
+        return sum(self.durations.values())
+
+    def finished(self):
+        return self.remaining == 0
+
+    def next_unit(self):
+        """
+        Ready unit with the highest rank that can lock its resources now.
+        The unit holds its locks till done() is called for it.
+        :return: WorkUnit or None if there is no unit to start now
+        """
+        skipped = []
+        unit = None
+        while self._ready:
+            item = heapq.heappop(self._ready)
+            locks = self.locks[item[2]]
+            if self.resources.available(locks):
+                self.resources.acquire(locks)
+                unit = self.units[item[2]]
+                break
+            skipped.append(item)
+
+        for item in skipped:
+            heapq.heappush(self._ready, item)
+        return unit
+
+    def done(self, unit):
+        """
+        Mark unit finished (with any status), release its locks and units waiting for it.
+        """
+        self.remaining -= 1
+        self.resources.release(self.locks[unit.name])
+        for name in self.successors[unit.name]:
+            self.waiting_for[name] -= 1
+            if self.waiting_for[name] == 0:
+                self._push(name)
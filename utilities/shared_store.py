@@ -0,0 +1,200 @@
+from collections.abc import MutableMapping
+
+import threading
+import sqlite3
+import json
+import os
+
+
+def _shared(store, key, path, value):
+    if isinstance(value, dict):
+        return SharedDict(store, key, path, value)
+    if isinstance(value, list):
+        return SharedList(store, key, path, value)
+    return value
+
+
+class _SharedValue(object):
+    """
+    Dict or list read from SharedStore, its changes are written through to the store.
+    Every change is applied to the value stored right now by update_value, at the same path,
+    so changes of other keys or other parts of the value made by other processes are kept.
+    """
+
+    def __init__(self, store, key, path, value):
+        super(_SharedValue, self).__init__(value)
+        self._store = store
+        self._key = key
+        self._path = path
+
+    def _change(self, method, *args, **kwargs):
+        def change(value):
+            target = value
+            for step in self._path:
+                target = target[step]
+            getattr(target, method)(*args, **kwargs)
+            return value
+
+        self._store.update_value(self._key, change)
+        return getattr(super(_SharedValue, self), method)(*args, **kwargs)
+
+    def __getitem__(self, index):
+        value = super(_SharedValue, self).__getitem__(index)
+        if isinstance(index, slice):
+            return value
+        return _shared(self._store, self._key, self._path + (index,), value)
+
+    def __setitem__(self, index, value):
+        self._change('__setitem__', index, value)
+
+    def __delitem__(self, index):
+        self._change('__delitem__', index)
+
+    def clear(self):
+        self._change('clear')
+
+    def pop(self, *args):
+        return self._change('pop', *args)
+
+
+class SharedDict(_SharedValue, dict):
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def update(self, *args, **kwargs):
+        self._change('update', dict(*args, **kwargs))
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._change('setdefault', key, default)
+        return self[key]
+
+    def popitem(self):
+        key = next(reversed(list(self.keys())))
+        return key, self.pop(key)
+
+
+class SharedList(_SharedValue, list):
+
+    def append(self, value):
+        self._change('append', value)
+
+    def extend(self, values):
+        self._change('extend', list(values))
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def insert(self, index, value):
+        self._change('insert', index, value)
+
+    def remove(self, value):
+        self._change('remove', value)
+
+    def reverse(self):
+        self._change('reverse')
+
+    def sort(self, **kwargs):
+        self._change('sort', **kwargs)
+
+
+class SharedStore(MutableMapping):
+    """
+    Key-value store shared by all behave processes of one parallel run.
+    Backed by SQLite file, path is given to behave processes by parallel_runner.py in ENV_VAR.
+    Values are stored as JSON, every write is an atomic update of one key,
+    so parallel processes never overwrite each other's keys.
+    Dicts and lists are returned as SharedDict and SharedList: store['k']['x'] = 1 changes the stored value.
+    Other values are copies, assign them again or change them by update_value.
+    """
+    ENV_VAR = 'PARALLEL_RUNNER_STORE'
+
+    def __init__(self, path, timeout=30):
+        """
+        :param path: str - path to SQLite file, created if it doesn't exist
+        :param timeout: int - seconds to wait for a lock held by another process
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    @classmethod
+    def from_env(cls):
+        """
+        Store of the current parallel run, None if behave is not started by parallel_runner.py.
+        """
+        path = os.environ.get(cls.ENV_VAR)
+        return cls(path) if path else None
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def __getitem__(self, key):
+        row = self._connection().execute('SELECT value FROM store WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _shared(self, key, (), json.loads(row[0]))
+
+    def __setitem__(self, key, value):
+        self._connection().execute('INSERT OR REPLACE INTO store (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def __delitem__(self, key):
+        if self._connection().execute('DELETE FROM store WHERE key = ?', (key,)).rowcount == 0:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter([row[0] for row in self._connection().execute('SELECT key FROM store ORDER BY key')])
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM store').fetchone()[0]
+
+    def __repr__(self):
+        return 'SharedStore({!r}, {})'.format(self.path, self.to_dict())
+
+    def setdefault(self, key, default=None):
+        """
+        Atomically set the value if the key is not set yet.
+        :return: value of the key
+        """
+        self._connection().execute('INSERT OR IGNORE INTO store (key, value) VALUES (?, ?)',
+                                   (key, json.dumps(default)))
+        return self[key]
+
+    def update_value(self, key, func, default=None):
+        """
+        Atomic read-modify-write of one key, other processes wait till it is done.
+        Example: store.update_value('counter', lambda value: value + 1, default=0)
+        :param func: function - gets current value (or default), returns new value
+        :return: new value
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT value FROM store WHERE key = ?', (key,)).fetchone()
+            value = func(default if row is None else json.loads(row[0]))
+            connection.execute('INSERT OR REPLACE INTO store (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return value
+
+    def to_dict(self):
+        return {key: json.loads(value) for key, value in self._connection().execute('SELECT key, value FROM store')}
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
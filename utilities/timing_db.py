@@ -0,0 +1,250 @@
+"""
+Timings of parallel runs kept in a local SQLite database between runs.
+parallel_runner.py registers every run and its units (worker, duration, status),
+behave hooks of every worker add features, scenarios (with browser startup time), steps
+and requests blocked by network policies of scenarios.
+Hooks find the database, run id and worker id in environment variables set by the runner.
+"""
+from utilities.durations import DurationStore
+
+import sqlite3
+import time
+import os
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL, finished REAL, processes INTEGER, mode TEXT);
+CREATE TABLE IF NOT EXISTS units (
+    run_id INTEGER, name TEXT, worker TEXT, started REAL, duration REAL, status TEXT);
+CREATE TABLE IF NOT EXISTS features (
+    run_id INTEGER, worker TEXT, name TEXT, filename TEXT, started REAL, duration REAL, status TEXT);
+CREATE TABLE IF NOT EXISTS scenarios (
+    run_id INTEGER, worker TEXT, feature TEXT, name TEXT, started REAL, duration REAL, status TEXT,
+    steps INTEGER, browser_startup REAL, browser_profile TEXT);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER, worker TEXT, feature TEXT, scenario TEXT, name TEXT, duration REAL, status TEXT);
+CREATE TABLE IF NOT EXISTS network (
+    run_id INTEGER, worker TEXT, feature TEXT, scenario TEXT, policies TEXT, blocked INTEGER, saved_bytes INTEGER,
+    unknown_size INTEGER);
+CREATE INDEX IF NOT EXISTS scenarios_run ON scenarios (run_id);
+CREATE INDEX IF NOT EXISTS steps_run ON steps (run_id);
+'''
+
+
+class TimingDB(object):
+    """
+    Connection to the timings database with queries used by the runner and "stats" command.
+    """
+    ENV_VAR = 'PARALLEL_RUNNER_TIMING_DB'
+    RUN_VAR = 'PARALLEL_RUNNER_RUN_ID'
+    WORKER_VAR = 'PARALLEL_RUNNER_WORKER'
+
+    def __init__(self, path, timeout=30):
+        """
+        :param path: str - path to SQLite file, created if it doesn't exist
+        :param timeout: int - seconds to wait for a lock held by another process
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        # databases of older versions
+        if 'browser_profile' not in [row[1] for row in self.connection.execute('PRAGMA table_info(scenarios)')]:
+            self.connection.execute('ALTER TABLE scenarios ADD COLUMN browser_profile TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def start_run(self, processes, mode):
+        """
+        :return: int - id of the new run
+        """
+        with self.connection:
+            cursor = self.connection.execute('INSERT INTO runs (started, processes, mode) VALUES (?, ?, ?)',
+                                             (time.time(), processes, mode))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.connection:
+            self.connection.execute('UPDATE runs SET finished = ? WHERE id = ?', (time.time(), run_id))
+
+    def add_unit(self, run_id, name, worker, started, duration, status):
+        with self.connection:
+            self.connection.execute('INSERT INTO units VALUES (?, ?, ?, ?, ?, ?)',
+                                    (run_id, name, worker, started, duration, status))
+
+    def insert(self, table, rows):
+        """
+        Insert rows into one table in one transaction.
+        :param table: str - one of tables of SCHEMA
+        :param rows: list of tuples with values of all table columns
+        """
+        if not rows:
+            return
+        placeholders = ', '.join('?' * len(rows[0]))
+        with self.connection:
+            self.connection.executemany('INSERT INTO {} VALUES ({})'.format(table, placeholders), rows)
+
+    def last_runs(self, count):
+        """
+        Ids of the last finished runs, the latest first.
+        """
+        return [row[0] for row in self.connection.execute(
+            'SELECT id FROM runs WHERE finished IS NOT NULL ORDER BY id DESC LIMIT ?', (count,))]
+
+    def _query(self, sql, run_ids):
+        if not run_ids:
+            return []
+        return self.connection.execute(sql.format(runs=', '.join('?' * len(run_ids))), run_ids).fetchall()
+
+    def slowest_scenarios(self, run_ids, limit):
+        """
+        :return: list of (feature, scenario, average, max, runs count, failed count)
+        """
+        return self._query('''
+            SELECT feature, name, AVG(duration), MAX(duration), COUNT(*), SUM(status = 'failed')
+            FROM scenarios WHERE run_id IN ({runs})
+            GROUP BY feature, name ORDER BY AVG(duration) DESC''', run_ids)[:limit]
+
+    def slowest_steps(self, run_ids, limit):
+        """
+        :return: list of (step, average, max, count, total time)
+        """
+        return self._query('''
+            SELECT name, AVG(duration), MAX(duration), COUNT(*), SUM(duration)
+            FROM steps WHERE run_id IN ({runs})
+            GROUP BY name ORDER BY AVG(duration) DESC''', run_ids)[:limit]
+
+    def regressions(self, run_id, previous_run_ids, threshold):
+        """
+        Scenarios of the run that took longer than the average of previous runs times threshold.
+        :return: list of (feature, scenario, duration, previous average, ratio), the worst first
+        """
+        previous = {(feature, name): average for feature, name, average in self._query('''
+            SELECT feature, name, AVG(duration) FROM scenarios WHERE run_id IN ({runs})
+            GROUP BY feature, name''', previous_run_ids)}
+
+        result = []
+        for feature, name, duration in self._query(
+                'SELECT feature, name, SUM(duration) FROM scenarios WHERE run_id IN ({runs}) GROUP BY feature, name',
+                [run_id]):
+            average = previous.get((feature, name))
+            if average and duration > average * threshold:
+                result.append((feature, name, duration, average, duration / average))
+        return sorted(result, key=lambda row: row[4], reverse=True)
+
+    def utilization(self, run_id):
+        """
+        Busy time of every worker of the run against the run wall time.
+        :return: (wall time, list of (worker, units count, busy time, average browser startup))
+        """
+        started, finished = self.connection.execute('SELECT started, finished FROM runs WHERE id = ?',
+                                                    (run_id,)).fetchone()
+        startups = {worker: startup for worker, startup in self.connection.execute(
+            'SELECT worker, AVG(browser_startup) FROM scenarios WHERE run_id = ? GROUP BY worker', (run_id,))}
+        workers = [(worker, count, busy, startups.get(worker)) for worker, count, busy in self.connection.execute(
+            'SELECT worker, COUNT(*), SUM(duration) FROM units WHERE run_id = ? GROUP BY worker ORDER BY worker',
+            (run_id,))]
+        return (finished or time.time()) - started, workers
+
+    def browser_startups(self, run_ids):
+        """
+        :return: list of (launch profile, browsers started, average startup, max startup)
+        """
+        return self._query('''
+            SELECT browser_profile, COUNT(*), AVG(browser_startup), MAX(browser_startup) FROM scenarios
+            WHERE run_id IN ({runs}) AND browser_startup IS NOT NULL
+            GROUP BY browser_profile ORDER BY AVG(browser_startup) DESC''', run_ids)
+
+    def network_savings(self, run_ids):
+        """
+        :return: list of (policies, scenarios count, blocked requests, estimated bytes saved, requests of unknown size)
+        """
+        return self._query('''
+            SELECT policies, COUNT(*), SUM(blocked), SUM(saved_bytes), SUM(unknown_size) FROM network
+            WHERE run_id IN ({runs}) GROUP BY policies ORDER BY SUM(saved_bytes) DESC''', run_ids)
+
+    def scenario_durations(self, run_ids):
+        """
+        Measured scenario durations in DurationStore format, for scheduling of the next run.
+        :return: dict - {scenario key: {'duration': average seconds, 'steps': steps count}}
+        """
+        return {DurationStore.scenario_key(feature, name): {'duration': round(average, 3), 'steps': steps}
+                for feature, name, average, steps in self._query('''
+                    SELECT feature, name, AVG(duration), MAX(steps) FROM scenarios
+                    WHERE run_id IN ({runs}) AND status != 'skipped' GROUP BY feature, name''', run_ids)}
+
+
+class TimingRecorder(object):
+    """
+    Collects timings in behave hooks of one worker and writes them to TimingDB once per feature.
+    """
+
+    def __init__(self, path, run_id, worker):
+        self.db = TimingDB(path)
+        self.run_id = run_id
+        self.worker = worker
+        self.rows = {'features': [], 'scenarios': [], 'steps': [], 'network': []}
+
+    @classmethod
+    def from_env(cls, worker=None):
+        """
+        Recorder of the current parallel run, None if behave is not started by parallel_runner.py.
+        :param worker: str - worker id, taken from environment if None (threads of one process share it)
+        """
+        path = os.environ.get(TimingDB.ENV_VAR)
+        if not path:
+            return None
+        return cls(path, int(os.environ[TimingDB.RUN_VAR]),
+                   worker or os.environ.get(TimingDB.WORKER_VAR, str(os.getpid())))
+
+    def feature(self, feature):
+        """
+        :type feature: behave.model.Feature
+        """
+        self.rows['features'].append((self.run_id, self.worker, feature.name, feature.filename,
+                                      _started(feature), feature.duration, feature.status.name))
+
+    def scenario(self, scenario, browser_startup=None, browser_profile=None):
+        """
+        :type scenario: behave.model.Scenario
+        :param browser_startup: float - seconds spent to start the browser for the scenario, None if reused
+        :param browser_profile: str - launch profile of the browser
+        """
+        self.rows['scenarios'].append((self.run_id, self.worker, scenario.feature.name, scenario.name,
+                                       _started(scenario), scenario.duration, scenario.status.name,
+                                       len(list(scenario.all_steps)), browser_startup, browser_profile))
+
+    def step(self, scenario, step):
+        """
+        :type scenario: behave.model.Scenario
+        :type step: behave.model.Step
+        """
+        self.rows['steps'].append((self.run_id, self.worker, scenario.feature.name, scenario.name,
+                                   '{} {}'.format(step.keyword, step.name), step.duration, step.status.name))
+
+    def network(self, scenario, policies, blocked, saved_bytes, unknown_size):
+        """
+        :type scenario: behave.model.Scenario
+        :param policies: list of str - network policy tags of the scenario
+        :param blocked: int - requests blocked by the policies
+        :param saved_bytes: int - estimated size of blocked requests
+        :param unknown_size: int - blocked requests never loaded before, not included in saved_bytes
+        """
+        self.rows['network'].append((self.run_id, self.worker, scenario.feature.name, scenario.name,
+                                     ' '.join(policies), blocked, saved_bytes, unknown_size))
+
+    def flush(self):
+        for table, rows in self.rows.items():
+            self.db.insert(table, rows)
+            del rows[:]
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def _started(model):
+    # behave keeps the start time only while the model runs
+    return time.time() - model.duration